@@ -1,18 +1,28 @@
 # agents/billing_agents.py
 from __future__ import annotations
 
+import asyncio
+import datetime as dt
+import functools
+import hashlib
 import os
-from typing import Optional, List, Dict, Any
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Any, FrozenSet, Sequence, Tuple
 
 from crewai import Agent, Task, Crew, LLM
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
 
-from utils.database import get_db_uri, get_tables, run_query
+from utils.database import get_db_uri, get_tables, run_query_rows
+from utils.llm_cache import SemanticCache
 from config.config import get_openai_api_key, get_openai_model
 
 
-def _build_llm() -> LLM:
+@functools.lru_cache(maxsize=1)
+def _get_llm() -> LLM:
     """
-    Create a CrewAI LLM instance using OpenAI.
+    Return the process-wide CrewAI LLM instance (OpenAI), created on first use.
 
     Requires OPENAI_API_KEY in environment (loaded via dotenv in config).
     """
@@ -31,30 +41,246 @@ def _build_llm() -> LLM:
     )
 
 
-def _format_rows(rows: List[Dict[str, Any]], max_rows: int = 5) -> str:
-    """Turn a list of dict rows into a readable text table snippet."""
+# Columns we try when filtering a table down to the current customer
+_CUSTOMER_ID_COLUMNS = (
+    "customer_id", "customerid", "email", "phone", "phone_number", "msisdn", "account_id",
+)
+
+# Tables the billing specialist can't do without; they go into the snapshot
+# first, in this order, whatever the size budget leaves for the rest
+_BILLING_TABLES = ("customer_usage", "service_plans", "customers")
+
+# Max number of tables probed concurrently while building the snapshot
+_SNAPSHOT_WORKERS = 8
+
+# The snapshot must be byte-for-byte stable for the same data, so that the
+# prompt prefix and the answer cache keyed on its hash can be reused:
+# rows are ordered by primary key, timestamps cut to seconds and
+# columns that change on their own are dropped.
+MAX_SNAPSHOT_BYTES = 8_000
+_VOLATILE_COLUMNS = frozenset({"updated_at", "last_seen"})
+_FRACTIONAL_SECONDS_RE = re.compile(r"^(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2})\.\d+")
+
+# Final billing answers, keyed on (customer, snapshot hash) + question.
+# Exact matches only: "my May bill" and "my June bill" embed almost the same,
+# but need different figures.
+_ANSWER_CACHE = SemanticCache(embed_fn=None)
+
+# Questions asking for an explanation get the Service Advisor's friendly
+# rewrite; for the rest the specialist's answer is returned as is
+_REWRITE_RE = re.compile(r"\b(explain|why|don.?t understand|confusing)\b", re.IGNORECASE)
+
+
+def needs_friendly_rewrite(query: str) -> bool:
+    """True if the question needs the second (customer-friendly rewrite) task."""
+    return bool(_REWRITE_RE.search(query))
+
+
+@functools.lru_cache(maxsize=None)
+def _table_columns(table: str) -> FrozenSet[str]:
+    """Return the column names of a table (cached, the schema is static)."""
+    _, rows = run_query_rows("SELECT name FROM pragma_table_info(:t)", {"t": table})
+    return frozenset(name for (name,) in rows)
+
+
+@functools.lru_cache(maxsize=None)
+def _table_primary_key(table: str) -> Tuple[str, ...]:
+    """Return the primary key columns of a table, in key order (cached)."""
+    _, rows = run_query_rows(
+        "SELECT name FROM pragma_table_info(:t) WHERE pk > 0 ORDER BY pk",
+        {"t": table},
+    )
+    return tuple(name for (name,) in rows)
+
+
+_IDENTIFIER_RE = re.compile(r"^\w+$")
+
+
+def _quote_identifier(name: str) -> str:
+    """Quote a table/column name for SQL; anything but plain \\w+ names is rejected."""
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Unsafe SQL identifier: {name!r}")
+    return f'"{name}"'
+
+
+def _order_by(table: str) -> str:
+    try:
+        pk = _table_primary_key(table)
+    except Exception:
+        pk = ()
+    return f" ORDER BY {', '.join(map(_quote_identifier, pk))}" if pk else ""
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_stmt(table: str, columns: Tuple[str, ...]) -> TextClause:
+    """
+    Statement selecting a table's rows for the customer, built once per table.
+
+    :val is the identifier the user logged in with, :cid the customer_id it
+    resolves to (see _resolve_customer_id), so tables keyed on either match.
+    """
+    where = " OR ".join(f"{_quote_identifier(col)} IN (:val, :cid)" for col in columns)
+    return text(
+        f"SELECT * FROM {_quote_identifier(table)} WHERE {where}{_order_by(table)} LIMIT 5"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _sample_stmt(table: str) -> TextClause:
+    """Statement selecting a few sample rows of a table, built once per table."""
+    return text(f"SELECT * FROM {_quote_identifier(table)}{_order_by(table)} LIMIT 5")
+
+
+def _resolve_customer_id(customer_identifier: str) -> str:
+    """
+    Map an email / phone / id to the customer's customer_id, so tables keyed
+    on customer_id (e.g. customer_usage) are filtered too. Falls back to the
+    identifier itself.
+    """
+    try:
+        columns = _table_columns("customers")
+        if "customer_id" not in columns:
+            return customer_identifier
+        match_columns = tuple(col for col in _CUSTOMER_ID_COLUMNS if col in columns)
+        result_columns, rows = run_query_rows(
+            _probe_stmt("customers", match_columns),
+            {"val": customer_identifier, "cid": customer_identifier},
+        )
+    except Exception:
+        return customer_identifier
+    if len(rows) != 1:
+        return customer_identifier
+    return rows[0][result_columns.index("customer_id")]
+
+
+def _canonical_value(value: Any) -> Any:
+    """Render timestamps with second precision so they don't churn the snapshot."""
+    if isinstance(value, dt.datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, str):
+        return _FRACTIONAL_SECONDS_RE.sub(r"\1", value)
+    return value
+
+
+def _format_rows(
+    columns: Sequence[str],
+    rows: Sequence[Tuple[Any, ...]],
+    max_rows: int = 5,
+) -> str:
+    """Turn (column names, row tuples) into a readable text table snippet."""
     if not rows:
         return "  (no rows)\n"
 
-    rows = rows[:max_rows]
-    columns = list(rows[0].keys())
+    keep = [i for i, col in enumerate(columns) if col not in _VOLATILE_COLUMNS]
 
-    lines = []
-    lines.append("  Columns: " + ", ".join(columns))
-    for r in rows:
-        parts = [f"{col}={r[col]!r}" for col in columns]
-        lines.append("  - " + ", ".join(parts))
-    return "\n".join(lines) + "\n"
+    header = "  Columns: " + ", ".join(columns[i] for i in keep)
+    body = (
+        "  - " + ", ".join(f"{columns[i]}={_canonical_value(r[i])!r}" for i in keep)
+        for r in rows[:max_rows]
+    )
+    return "\n".join((header, *body)) + "\n"
 
 
-def _build_db_snapshot(customer_identifier: Optional[str]) -> str:
+def _probe_table(
+    table: str,
+    customer_identifier: Optional[str],
+    customer_id: Optional[str] = None,
+) -> Tuple[str, bool]:
+    """
+    Return (snapshot section, found customer rows) for a single table.
+    Never raises.
+    """
+    lines: List[str] = [f"\nTable: {table}"]
+
+    # Filter by whichever customer identifier columns actually exist here
+    filtered_rows: Sequence[Tuple[Any, ...]] = ()
+    if customer_identifier:
+        try:
+            columns = _table_columns(table)
+        except Exception:
+            columns = frozenset()
+        match_columns = tuple(col for col in _CUSTOMER_ID_COLUMNS if col in columns)
+        if match_columns:
+            try:
+                result_columns, filtered_rows = run_query_rows(
+                    _probe_stmt(table, match_columns),
+                    {"val": customer_identifier, "cid": customer_id or customer_identifier},
+                )
+            except Exception:
+                filtered_rows = ()
+            if filtered_rows:
+                values = dict.fromkeys((customer_identifier, customer_id or customer_identifier))
+                lines.append(
+                    f"  Rows for {' / '.join(match_columns)} in "
+                    f"{' / '.join(map(repr, values))}:"
+                )
+                lines.append(_format_rows(result_columns, filtered_rows))
+
+    # If we didn't find any filtered rows, just show a sample of the table
+    if not filtered_rows:
+        try:
+            result_columns, sample_rows = run_query_rows(_sample_stmt(table))
+            lines.append("  Sample rows:")
+            lines.append(_format_rows(result_columns, sample_rows))
+        except Exception as e:
+            lines.append(f"  (Failed to query table {table}: {type(e).__name__}: {e})")
+
+    return "\n".join(lines), bool(filtered_rows)
+
+
+def _select_sections(
+    sections: List[Tuple[str, str, bool]],
+    query: str,
+    budget: int,
+) -> Tuple[List[str], List[str]]:
+    """
+    Pick which table sections fit in the byte budget.
+
+    Priority: the billing tables (_BILLING_TABLES), then tables with the
+    customer's own rows, then tables whose name shares a word with the
+    query, then the rest. The kept sections are
+    returned in their original (table name) order so that the snapshot
+    doesn't depend on the wording of the question when everything fits.
+    Returns (kept sections, omitted table names).
+    """
+    query_tokens = set(re.findall(r"[a-z0-9]+", query.lower()))
+
+    def priority(item: Tuple[int, Tuple[str, str, bool]]):
+        i, (table, _, matched) = item
+        overlap = len(query_tokens & set(table.lower().split("_")))
+        billing_rank = (
+            _BILLING_TABLES.index(table) if table in _BILLING_TABLES else len(_BILLING_TABLES)
+        )
+        return (billing_rank, not matched, -overlap, i)
+
+    kept, used = set(), 0
+    for i, (_, text, _) in sorted(enumerate(sections), key=priority):
+        size = len(text.encode("utf-8")) + 1
+        if used + size <= budget:
+            kept.add(i)
+            used += size
+
+    return (
+        [text for i, (_, text, _) in enumerate(sections) if i in kept],
+        [table for i, (table, _, _) in enumerate(sections) if i not in kept],
+    )
+
+
+def _omitted_line(tables: List[str]) -> str:
+    return f"\n(Omitted to keep the snapshot short: {', '.join(tables)})"
+
+
+def _build_db_snapshot(customer_identifier: Optional[str], query: str = "") -> str:
     """
     Build a textual snapshot of relevant DB data for the customer.
 
     Strategy:
       - List all tables.
-      - For each table, show up to a few rows.
-      - If we have a customer identifier, try some common column names to filter.
+      - Probe the tables concurrently (they are independent, read-only queries).
+      - Per table, filter on the customer identifier columns it actually has,
+        otherwise show a sample of the table (rows in primary key order).
+      - Keep the snapshot under MAX_SNAPSHOT_BYTES, preferring the billing
+        tables, the customer's own rows and tables named like words in the query.
       - Ignore any SQL errors (we don't want to crash the app).
     """
     lines: List[str] = []
@@ -64,54 +290,49 @@ def _build_db_snapshot(customer_identifier: Optional[str]) -> str:
 
     try:
         tables = get_tables()
+        if not tables:
+            return "(No tables found in the database.)"
+
+        customer_id = (
+            _resolve_customer_id(customer_identifier) if customer_identifier else None
+        )
+
+        workers = min(_SNAPSHOT_WORKERS, len(tables))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # executor.map keeps the sections in table order
+            probes = list(
+                executor.map(
+                    lambda t: _probe_table(t, customer_identifier, customer_id), tables
+                )
+            )
     except Exception as e:
         return f"(Failed to inspect database tables: {type(e).__name__}: {e})"
 
-    if not tables:
-        return "(No tables found in the database.)"
-
-    for table in tables:
-        lines.append(f"\nTable: {table}")
-
-        # First, try to filter by common customer identifier columns
-        filtered_rows: List[Dict[str, Any]] = []
-        if customer_identifier:
-            candidate_columns = ["customer_id", "customerid", "email", "phone", "msisdn", "account_id"]
-            for col in candidate_columns:
-                try:
-                    filtered_rows = run_query(
-                        f"SELECT * FROM {table} WHERE {col} = :val LIMIT 5",
-                        {"val": customer_identifier},
-                    )
-                    if filtered_rows:
-                        lines.append(f"  Rows for {col} = {customer_identifier!r}:")
-                        lines.append(_format_rows(filtered_rows))
-                        break  # stop trying other columns for this table
-                except Exception:
-                    # Column might not exist in this table; just ignore
-                    continue
-
-        # If we didn't find any filtered rows, just show a sample of the table
-        if not filtered_rows:
-            try:
-                sample_rows = run_query(f"SELECT * FROM {table} LIMIT 5")
-                lines.append("  Sample rows:")
-                lines.append(_format_rows(sample_rows))
-            except Exception as e:
-                lines.append(f"  (Failed to query table {table}: {type(e).__name__}: {e})")
+    # Reserve room for the longest possible "(Omitted ...)" line (every table)
+    budget = (
+        MAX_SNAPSHOT_BYTES
+        - sum(len(line.encode("utf-8")) + 1 for line in lines)
+        - len(_omitted_line(tables).encode("utf-8")) - 1
+    )
+    sections = [(table, text, matched) for table, (text, matched) in zip(tables, probes)]
+    kept, omitted = _select_sections(sections, query, budget)
+
+    lines.extend(kept)
+    if omitted:
+        lines.append(_omitted_line(omitted))
 
     return "\n".join(lines)
 
 
-def create_billing_crew(db_snapshot: str) -> Crew:
+@functools.lru_cache(maxsize=1)
+def _get_billing_agents() -> Tuple[Agent, Agent]:
     """
-    Create a CrewAI crew for telecom billing & account queries.
+    Return the (billing specialist, service advisor) agents, built once.
 
-    Agents:
-      - Billing Specialist: uses the DB snapshot text to investigate
-      - Service Advisor: explains results clearly to customer
+    Their role/goal/backstory text is static, so the system prompt CrewAI
+    builds from it is byte-identical across requests (prefix-cacheable).
     """
-    llm = _build_llm()
+    llm = _get_llm()
 
     billing_specialist = Agent(
         role="Telecom Billing Specialist",
@@ -146,6 +367,27 @@ def create_billing_crew(db_snapshot: str) -> Crew:
         allow_delegation=False,
     )
 
+    return billing_specialist, service_advisor
+
+
+def create_billing_crew(rewrite: bool = True) -> Crew:
+    """
+    Create a CrewAI crew for telecom billing & account queries.
+
+    Agents (copied from the templates in _get_billing_agents):
+      - Billing Specialist: uses the DB snapshot text to investigate
+      - Service Advisor: explains results clearly to customer
+        (only when rewrite=True; otherwise the crew is the specialist alone)
+
+    The crew is cheap to build and holds per-run state (task outputs, agent
+    executors), so build one per request; concurrent requests never share it.
+    Per-request data (identifier, question, DB snapshot) is templated into
+    the task descriptions by crew.kickoff(inputs=...).
+    """
+    billing_specialist, service_advisor = (
+        agent.copy() for agent in _get_billing_agents()
+    )
+
     billing_task = Task(
         description=(
             "You are given:\n"
@@ -156,15 +398,26 @@ def create_billing_crew(db_snapshot: str) -> Crew:
             "Use ONLY the information in the database snapshot and logical reasoning "
             "to investigate the most likely reasons for the charges the customer is "
             "asking about.\n\n"
-            "Customer identifier: {customer_identifier}\n"
-            "Customer question: {query}\n\n"
+            # Dynamic inputs last, most stable first: the static text above plus
+            # the same customer's snapshot form a reusable prompt prefix
+            "Customer identifier: {customer_identifier}\n\n"
             "Database snapshot:\n"
-            "{db_snapshot}\n"
+            "{db_snapshot}\n\n"
+            "Customer question: {query}\n"
         ),
+        # Without the Service Advisor this output goes straight to the customer
         expected_output=(
-            "A concise technical summary of what you found in the database snapshot: "
-            "which tables/rows are relevant and what they show about the customer's "
-            "bills and charges."
+            (
+                "A concise technical summary of what you found in the database snapshot: "
+                "which tables/rows are relevant and what they show about the customer's "
+                "bills and charges."
+            )
+            if rewrite
+            else (
+                "A short, direct answer to the customer's question, addressed to the "
+                "customer, quoting the relevant amounts, dates or plan details from "
+                "the snapshot. No table or column names."
+            )
         ),
         agent=billing_specialist,
     )
@@ -186,6 +439,13 @@ def create_billing_crew(db_snapshot: str) -> Crew:
         agent=service_advisor,
     )
 
+    if not rewrite:
+        return Crew(
+            agents=[billing_specialist],
+            tasks=[billing_task],
+            verbose=True,
+        )
+
     crew = Crew(
         agents=[billing_specialist, service_advisor],
         tasks=[billing_task, summary_task],
@@ -205,16 +465,42 @@ def process_billing_query(
     query: natural language billing question
     """
     # Build a textual snapshot of DB content for this customer
-    db_snapshot = _build_db_snapshot(customer_identifier)
+    db_snapshot = _build_db_snapshot(customer_identifier, query)
+
+    # Same customer + byte-identical data → the earlier answer still holds
+    snapshot_hash = hashlib.sha256(db_snapshot.encode("utf-8")).hexdigest()
+
+    # Plain lookups ("what's my current bill?") skip the Service Advisor's LLM call
+    rewrite = needs_friendly_rewrite(query)
+
+    def kickoff() -> str:
+        crew = create_billing_crew(rewrite)
+        result = crew.kickoff(
+            inputs={
+                "customer_identifier": customer_identifier or "unknown",
+                "query": query,
+                "db_snapshot": db_snapshot,
+            }
+        )
 
-    crew = create_billing_crew(db_snapshot=db_snapshot)
+        return str(result)
 
-    result = crew.kickoff(
-        inputs={
-            "customer_identifier": customer_identifier or "unknown",
-            "query": query,
-            "db_snapshot": db_snapshot,
-        }
+    return _ANSWER_CACHE.get_or_compute(
+        ("billing", customer_identifier, snapshot_hash, rewrite),
+        query,
+        kickoff,
     )
 
-    return str(result)
+
+async def aprocess_billing_query(
+    customer_identifier: Optional[str],
+    query: str,
+) -> str:
+    """
+    Async variant of process_billing_query.
+
+    The steps depend on each other (snapshot → specialist → advisor), so the
+    whole pipeline runs in a worker thread; this keeps the event loop free
+    for other branches.
+    """
+    return await asyncio.to_thread(process_billing_query, customer_identifier, query)
@@ -1,14 +1,29 @@
 # agents/knowledge_agents.py
 from __future__ import annotations
 
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import threading
 from pathlib import Path
-from typing import Optional
-
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings
+from typing import Any, List, Optional
+
+from llama_index.core import (
+    VectorStoreIndex,
+    SimpleDirectoryReader,
+    Settings,
+    StorageContext,
+    load_index_from_storage,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
 from llama_index.llms.openai import OpenAI as LlamaOpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
 
 from config.config import get_openai_api_key, get_openai_model
+from utils.llm_cache import SemanticCache, is_dynamic_query, semantic_cache
 
 # ---- Optional FAISS integration ----
 try:
@@ -22,13 +37,171 @@ except Exception:
     FaissVectorStore = None  # type: ignore
     HAS_FAISS = False
 
+# ---- Optional local ONNX embeddings ----
+try:
+    import numpy as np
+    import onnxruntime as ort  # type: ignore
+    from tokenizers import Tokenizer  # type: ignore
+
+    HAS_ONNX = True
+except Exception:
+    # Without onnxruntime/tokenizers we keep using OpenAI embeddings
+    ort = None  # type: ignore
+    Tokenizer = None  # type: ignore
+    HAS_ONNX = False
+
 
 BASE_DIR = Path(__file__).parent.parent
 DOCS_DIR = BASE_DIR / "data" / "documents"
 FAISS_DIR = BASE_DIR / "data" / "faiss_store"
-FAISS_INDEX_PATH = FAISS_DIR / "faiss_index.bin"
+# Written by StorageContext.persist() alongside the docstore / index store
+FAISS_INDEX_PATH = FAISS_DIR / "default__vector_store.json"
+DOCSTORE_PATH = FAISS_DIR / "docstore.json"
+DOCS_HASH_PATH = FAISS_DIR / "documents.sha256"
+
+# Local int8 all-MiniLM-L6-v2 exported to ONNX, used instead of OpenAI
+# embeddings when present. To create it:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 data/onnx_minilm
+#   then ORTQuantizer.from_pretrained("data/onnx_minilm").quantize(
+#       save_dir="data/onnx_minilm",
+#       quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False))
+LOCAL_EMBED_DIR = Path(os.getenv("LOCAL_EMBED_DIR", BASE_DIR / "data" / "onnx_minilm"))
+LOCAL_EMBED_MODEL = LOCAL_EMBED_DIR / "model_quantized.onnx"
+LOCAL_EMBED_TOKENIZER = LOCAL_EMBED_DIR / "tokenizer.json"
+LOCAL_EMBED_MAX_TOKENS = 256
+USE_LOCAL_EMBEDDINGS = (
+    HAS_ONNX and LOCAL_EMBED_MODEL.exists() and LOCAL_EMBED_TOKENIZER.exists()
+)
+
+# FAISS index layout; part of the docs fingerprint so a layout change forces a rebuild
+if USE_LOCAL_EMBEDDINGS:
+    EMBED_MODEL_NAME = "all-MiniLM-L6-v2-int8"
+    EMBED_DIM = 384
+else:
+    EMBED_MODEL_NAME = "openai"
+    EMBED_DIM = 1536  # works for text-embedding-3-small / ada-002 etc.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+INDEX_LAYOUT = (
+    f"{EMBED_MODEL_NAME}-hnsw-ip-d{EMBED_DIM}-m{HNSW_M}-efc{HNSW_EF_CONSTRUCTION}"
+)
+
+# Texts per embeddings API request, and how many requests run concurrently
+EMBED_BATCH_SIZE = 256
+EMBED_WORKERS = 8
 
 _INDEX: VectorStoreIndex | None = None
+_INDEX_LOCK = threading.Lock()
+
+_ANSWER_CACHE = SemanticCache()
+
+# Prefixes of the error answers below; those are never cached
+_ERROR_PREFIXES = (
+    "Knowledge assistant is not configured correctly.",
+    "Sorry, I ran into a problem while searching the knowledge base.",
+)
+
+
+def _l2_normalize(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    return [x / norm for x in vec] if norm else vec
+
+
+class _NormalizedEmbedding(BaseEmbedding):
+    """
+    Wrap an embedding model so every vector comes back L2-normalized.
+
+    With unit vectors, FAISS inner product equals cosine similarity, for both
+    the documents added to the index and the queries searched against it.
+    """
+
+    inner: BaseEmbedding
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NormalizedEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return _l2_normalize(self.inner.get_query_embedding(query))
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return _l2_normalize(await self.inner.aget_query_embedding(query))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return _l2_normalize(self.inner.get_text_embedding(text))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [_l2_normalize(v) for v in self.inner.get_text_embedding_batch(texts)]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return _l2_normalize(await self.inner.aget_text_embedding(text))
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # Called once per batch; batches are spread over num_workers by the base class
+        return [_l2_normalize(v) for v in await self.inner.aget_text_embedding_batch(texts)]
+
+
+class _OnnxEmbedding(BaseEmbedding):
+    """
+    Sentence-transformers model (mean pooling) run locally with onnxruntime.
+
+    No network round-trip and no per-query spend; with the int8 (VNNI)
+    quantized MiniLM a batch of short texts takes a few milliseconds on CPU.
+    """
+
+    model_path: str
+    tokenizer_path: str
+    max_length: int = LOCAL_EMBED_MAX_TOKENS
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: Any = PrivateAttr()
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        tokenizer = Tokenizer.from_file(self.tokenizer_path)
+        tokenizer.enable_truncation(max_length=self.max_length)
+        tokenizer.enable_padding()
+        self._tokenizer = tokenizer
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeddings = self._session.run(None, feeds)[0]
+
+        # Mean over the real (non-padding) tokens
+        mask = attention_mask[..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        return (summed / np.clip(mask.sum(axis=1), 1e-9, None)).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
 
 
 def _init_llama_settings() -> None:
@@ -43,7 +216,19 @@ def _init_llama_settings() -> None:
         model=get_openai_model(),
         api_key=api_key,
     )
-    Settings.embed_model = OpenAIEmbedding(api_key=api_key)
+    if USE_LOCAL_EMBEDDINGS:
+        inner: BaseEmbedding = _OnnxEmbedding(
+            model_path=str(LOCAL_EMBED_MODEL),
+            tokenizer_path=str(LOCAL_EMBED_TOKENIZER),
+            embed_batch_size=EMBED_BATCH_SIZE,
+        )
+    else:
+        inner = OpenAIEmbedding(api_key=api_key, embed_batch_size=EMBED_BATCH_SIZE)
+    Settings.embed_model = _NormalizedEmbedding(
+        inner=inner,
+        embed_batch_size=EMBED_BATCH_SIZE,
+        num_workers=EMBED_WORKERS,
+    )
 
 
 def _load_documents():
@@ -74,38 +259,111 @@ def _build_index_default() -> VectorStoreIndex:
     return VectorStoreIndex.from_documents(documents)
 
 
+def _documents_fingerprint() -> str:
+    """sha256 over the index layout and the knowledge base file list + sizes + mtimes."""
+    digest = hashlib.sha256(INDEX_LAYOUT.encode())
+    for path in sorted(DOCS_DIR.rglob("*")):
+        if path.is_file():
+            stat = path.stat()
+            digest.update(
+                f"{path.relative_to(DOCS_DIR).as_posix()}|{stat.st_size}|{stat.st_mtime_ns}\n".encode()
+            )
+    return digest.hexdigest()
+
+
+def _persisted_index_is_current(fingerprint: str) -> bool:
+    """True if a full persisted index exists and was built from the current docs."""
+    return (
+        FAISS_INDEX_PATH.exists()
+        and DOCSTORE_PATH.exists()
+        and DOCS_HASH_PATH.exists()
+        and DOCS_HASH_PATH.read_text().strip() == fingerprint
+    )
+
+
+def _load_faiss_vector_store() -> "FaissVectorStore":
+    """
+    Load the persisted FAISS index memory-mapped instead of read into the heap.
+
+    Vector pages are loaded on demand and live in the OS page cache, so every
+    worker process serving the app shares one copy (and starts without
+    copying the whole index). Falls back to a regular read if mmap is not
+    supported for the file.
+
+    The mmapped index is read-only: add() on it aborts the process, so never
+    insert into the loaded index; change the docs and let it rebuild.
+    """
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        faiss_index = faiss.read_index(str(FAISS_INDEX_PATH), mmap_flag)
+    except Exception:
+        faiss_index = faiss.read_index(str(FAISS_INDEX_PATH))
+    faiss_index.hnsw.efSearch = HNSW_EF_SEARCH
+    return FaissVectorStore(faiss_index=faiss_index)
+
+
 def _build_index_faiss() -> VectorStoreIndex:
     """
     Build a FAISS-backed index using LlamaIndex's FaissVectorStore.
 
+    The whole StorageContext (FAISS vectors + docstore + index store) is
+    persisted to FAISS_DIR, so later runs load it instead of re-embedding
+    (with the vectors memory-mapped, see _load_faiss_vector_store).
+    It is rebuilt only when the documents change.
+
     If anything fails, the caller should fall back to _build_index_default().
     """
     if not HAS_FAISS or FaissVectorStore is None:
         raise RuntimeError("FAISS or FaissVectorStore is not available")
 
-    documents = _load_documents()
-
     # Ensure directory exists
     FAISS_DIR.mkdir(parents=True, exist_ok=True)
 
-    # If an index file exists, load it
-    if FAISS_INDEX_PATH.exists():
-        faiss_index = faiss.read_index(str(FAISS_INDEX_PATH))
-        vector_store = FaissVectorStore(faiss_index=faiss_index)
-        index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
-    else:
-        # Create a new FAISS index with typical OpenAI embedding dimension
-        d = 1536  # works for text-embedding-3-small / ada-002 etc.
-        faiss_index = faiss.IndexFlatL2(d)
+    fingerprint = _documents_fingerprint()
 
-        # Attach FAISS index to the vector store
-        vector_store = FaissVectorStore(faiss_index=faiss_index)
+    # If a persisted index for these docs exists, load it
+    if _persisted_index_is_current(fingerprint):
+        vector_store = _load_faiss_vector_store()
+        storage_context = StorageContext.from_defaults(
+            vector_store=vector_store,
+            persist_dir=str(FAISS_DIR),
+        )
+        return load_index_from_storage(storage_context)
 
-        # Build index from documents (this will populate faiss_index via the vector store)
-        index = VectorStoreIndex.from_documents(documents, vector_store=vector_store)
+    documents = _load_documents()
 
-        # 🚨 Explicitly save FAISS index to disk
-        faiss.write_index(faiss_index, str(FAISS_INDEX_PATH))
+    # HNSW graph over inner product (= cosine, embeddings are normalized):
+    # O(log N) search instead of the exhaustive scan of IndexFlatL2
+    faiss_index = faiss.IndexHNSWFlat(EMBED_DIM, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    faiss_index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    faiss_index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    # Attach FAISS index to the vector store
+    vector_store = FaissVectorStore(faiss_index=faiss_index)
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+
+    # Build index from documents (this will populate faiss_index via the vector store).
+    # use_async embeds the EMBED_BATCH_SIZE batches concurrently (EMBED_WORKERS at a time).
+    index = VectorStoreIndex.from_documents(
+        documents,
+        storage_context=storage_context,
+        use_async=True,
+    )
+
+    # Persist vectors + node texts, then record which docs they came from.
+    # Written to a scratch dir and moved in file by file with os.replace:
+    # other workers may have the old index mmapped, and overwriting it in
+    # place would change pages under them (SIGBUS / torn reads), while a
+    # replaced file stays intact for them. The fingerprint moves last, so it
+    # never vouches for a half-moved store.
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".faiss_store-", dir=FAISS_DIR.parent))
+    try:
+        index.storage_context.persist(persist_dir=str(tmp_dir))
+        (tmp_dir / DOCS_HASH_PATH.name).write_text(fingerprint)
+        for path in sorted(tmp_dir.iterdir(), key=lambda p: p.name == DOCS_HASH_PATH.name):
+            os.replace(path, FAISS_DIR / path.name)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
     return index
 
@@ -117,21 +375,55 @@ def _get_index() -> VectorStoreIndex:
     Preference:
       1. Use FAISS vector store if available.
       2. Otherwise, use default in-memory vector store.
+
+    The index is warmed in a background thread at import; a query arriving
+    before that finishes waits on the lock instead of building a second copy.
     """
     global _INDEX
-    if _INDEX is None:
-        _init_llama_settings()
-        if HAS_FAISS:
-            try:
-                _INDEX = _build_index_faiss()
-            except Exception:
-                # If FAISS fails for any reason, safely fall back
+    if _INDEX is not None:
+        return _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _init_llama_settings()
+            if HAS_FAISS:
+                try:
+                    _INDEX = _build_index_faiss()
+                except Exception:
+                    # If FAISS fails for any reason, safely fall back
+                    _INDEX = _build_index_default()
+            else:
                 _INDEX = _build_index_default()
-        else:
-            _INDEX = _build_index_default()
     return _INDEX
 
 
+def _warm_index() -> None:
+    """Load the index ahead of the first query (errors resurface on that query)."""
+    try:
+        _get_index()
+    except Exception:
+        pass
+
+
+threading.Thread(target=_warm_index, name="knowledge-index-warmup", daemon=True).start()
+
+
+def _answer_cache_key(query: str, customer_email: Optional[str] = None):
+    """
+    Docs answers are shared by everyone, unless the query is about live account state.
+
+    The prompt doesn't include the customer, so a shared key can't hand one
+    customer's personalised answer to another.
+    """
+    if customer_email and is_dynamic_query(query):
+        return None
+    return ("knowledge",), query
+
+
+@semantic_cache(
+    _ANSWER_CACHE,
+    key=_answer_cache_key,
+    cache_if=lambda answer: not answer.startswith(_ERROR_PREFIXES),
+)
 def answer_knowledge_query(
     query: str,
     customer_email: Optional[str] = None,
@@ -158,7 +450,6 @@ def answer_knowledge_query(
     full_question = (
         "You are a Telecom Technical Support Assistant. Use ONLY the provided "
         "documentation and retrieved context to answer precisely.\n\n"
-        f"Customer: {customer_email or 'unknown'}\n"
         f"Question: {query}\n\n"
         "If the exact steps are not clearly in the docs, say that and provide a "
         "generic best-practice answer, noting that details may vary by device/operator."
@@ -1,24 +1,22 @@
 # agents/network_agents.py
 from __future__ import annotations
 
-from typing import Optional
-from openai import OpenAI
-
-from config.config import get_openai_api_key, get_openai_model
+import functools
+from typing import Optional, Dict
 
+import httpx
+from openai import AsyncOpenAI, OpenAI
 
-def _build_client() -> OpenAI:
-    key = get_openai_api_key()
-    if not key:
-        raise RuntimeError("Missing OPENAI_API_KEY in your environment or .env")
-    return OpenAI(api_key=key)
+from config.config import get_openai_api_key, get_openai_model
+from utils.batcher import PromptBatcher
 
 
-def _diagnostics_agent(query: str, customer_id: Optional[str]) -> str:
-    client = _build_client()
+# Static prompt shared by every request. Keep it first and byte-identical so the
+# provider's automatic prompt-prefix caching can reuse it across calls.
+SPECIALISTS_PROMPT = """
+You are a Telecom Network Support Team made of two specialists.
 
-    system_prompt = """
-You are a Telecom Network Diagnostics Specialist.
+1) Network Diagnostics Specialist
 Analyze network issues including:
 - slow internet
 - no signal
@@ -32,77 +30,137 @@ Follow this structure:
 2. Check if it is device-related or network-area-related
 3. Mention what parameters need to be checked (signal strength, APN, VoLTE toggle)
 4. Give a technical summary (NOT customer-facing)
-"""
-
-    message = (
-        f"Customer identifier: {customer_id}\n"
-        f"Reported issue: {query}\n"
-        "Generate your technical diagnostic analysis:"
-    )
-
-    response = client.chat.completions.create(
-        model=get_openai_model(),
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": message},
-        ],
-        temperature=0.2,
-    )
-
-    return response.choices[0].message.content
 
-
-def _resolution_agent(diagnostics_summary: str) -> str:
-    client = _build_client()
-
-    system_prompt = """
-You are a Telecom Network Resolution Specialist.
-Your job is to convert technical diagnostics into:
+2) Network Resolution Specialist
+Convert the technical diagnostics into:
 - a clear explanation
 - friendly language
 - 3–5 clear steps the customer can follow
 - a possible root cause
 - optional tips to prevent it in future
 
-Do NOT be too technical. Be helpful.
+Do NOT be too technical in the customer explanation. Be helpful.
+"""
+
+# Output format for the (batched) JSON path used by process_network_query
+SYSTEM_PROMPT = SPECIALISTS_PROMPT + """
+Each answer is a JSON object with two fields:
+- "diagnostics_summary": the Diagnostics Specialist's technical analysis
+- "customer_explanation": the Resolution Specialist's customer-facing explanation with steps
 """
 
-    user_msg = (
-        "Here is the technical diagnostics summary from the engineering system:\n\n"
-        f"{diagnostics_summary}\n\n"
-        "Convert this into a helpful customer-facing explanation with steps."
+ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "diagnostics_summary": {"type": "string"},
+        "customer_explanation": {"type": "string"},
+    },
+    "required": ["diagnostics_summary", "customer_explanation"],
+    "additionalProperties": False,
+}
+
+# ---- Optional HTTP/2 support (httpx needs the h2 package for it) ----
+try:
+    import h2  # type: ignore  # noqa: F401
+
+    HAS_HTTP2 = True
+except Exception:
+    HAS_HTTP2 = False
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> OpenAI:
+    """
+    Return the process-wide OpenAI client.
+
+    The client (and its keep-alive connection pool) is thread-safe and reused
+    by every request, so we only pay the TCP/TLS handshake once.
+    """
+    key = get_openai_api_key()
+    if not key:
+        raise RuntimeError("Missing OPENAI_API_KEY in your environment or .env")
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        http2=HAS_HTTP2,
+        timeout=60,
+    )
+    return OpenAI(api_key=key, http_client=http_client)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_async_client() -> AsyncOpenAI:
+    """Async counterpart of _get_client, used by the micro-batcher's event loop."""
+    key = get_openai_api_key()
+    if not key:
+        raise RuntimeError("Missing OPENAI_API_KEY in your environment or .env")
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        http2=HAS_HTTP2,
+        timeout=60,
     )
+    return AsyncOpenAI(api_key=key, http_client=http_client)
 
-    response = client.chat.completions.create(
-        model=get_openai_model(),
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_msg},
-        ],
-        temperature=0.4,
+
+# Concurrent network queries (e.g. from several sessions) share one completion
+_BATCHER = PromptBatcher(
+    client_factory=_get_async_client,
+    model_factory=get_openai_model,
+    system_prompt=SYSTEM_PROMPT,
+    item_schema=ANSWER_SCHEMA,
+    temperature=0.3,
+)
+
+
+def _user_message(query: str) -> str:
+    """
+    Dynamic part of the prompt; always sent after the static system prompt.
+
+    It carries no customer identifier: the batcher packs several customers'
+    prompts into one request, and the diagnosis doesn't use it.
+    """
+    return (
+        f"Reported issue: {query}\n"
+        "Generate the technical diagnostic analysis and the customer-facing explanation."
     )
 
-    return response.choices[0].message.content
+
+def _network_support_agent(query: str) -> Dict[str, str]:
+    """Run diagnostics and resolution in a single (micro-batched) structured completion."""
+    return _BATCHER.submit(_user_message(query))
+
+
+def _format_result(result: Dict[str, str]) -> str:
+    return (
+        "### Network Diagnostics (Internal)\n"
+        f"{result['diagnostics_summary']}\n\n"
+        "### Final Explanation\n"
+        f"{result['customer_explanation']}"
+    )
 
 
 def process_network_query(query: str, customer_identifier: Optional[str] = None) -> str:
     """
     High-level method used by LangGraph node.
-    Multi-agent flow:
+    Multi-agent flow (one completion):
         Diagnostics Agent  → Resolution Agent
+
+    customer_identifier is not sent to the model (see _user_message).
     """
 
     try:
-        diagnostics = _diagnostics_agent(query, customer_identifier)
-        resolution = _resolution_agent(diagnostics)
-
-        final_response = (
-            "### Network Diagnostics (Internal)\n"
-            f"{diagnostics}\n\n"
-            "### Final Explanation\n"
-            f"{resolution}"
-        )
-        return final_response
+        result = _network_support_agent(query)
+        return _format_result(result)
+
+    except Exception as e:
+        return f"Network troubleshooting failed: {type(e).__name__}: {e}"
+
+
+async def aprocess_network_query(query: str, customer_identifier: Optional[str] = None) -> str:
+    """Async variant of process_network_query (awaits the batcher, no blocked thread)."""
+
+    try:
+        result = await _BATCHER.asubmit(_user_message(query))
+        return _format_result(result)
 
     except Exception as e:
         return f"Network troubleshooting failed: {type(e).__name__}: {e}"
@@ -1,51 +1,102 @@
 # agents/service_agents.py
 from __future__ import annotations
  
-from typing import Optional, Dict, Any, List
+import asyncio
+import functools
+import re
+from typing import Optional, Dict, Any, List, Tuple
  
+import numpy as np
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
  
-from utils.database import run_query, get_tables
+from utils.database import run_query, has_table
 from config.config import get_openai_api_key, get_openai_model
+from utils.llm_cache import SemanticCache, is_dynamic_query, semantic_cache
  
  
 # ---------------------------------------------------------
 # Helpers to load customer profile
 # ---------------------------------------------------------
  
+# Latest customer_usage row, joined onto the customer as usage__<column>
+_USAGE_COLUMNS = (
+    "usage_id",
+    "customer_id",
+    "billing_period_start",
+    "billing_period_end",
+    "data_used_gb",
+    "voice_minutes_used",
+    "sms_count_used",
+    "additional_charges",
+    "total_bill_amount",
+)
+_USAGE_PREFIX = "usage__"
+ 
+_CUSTOMER_WITH_USAGE_SQL = f"""
+    WITH latest AS (
+        SELECT u.* FROM customer_usage u
+        JOIN customers c ON c.customer_id = u.customer_id
+        WHERE c.email = :email
+        ORDER BY u.billing_period_end DESC
+        LIMIT 1
+    )
+    SELECT c.*, {", ".join(f"l.{col} AS {_USAGE_PREFIX}{col}" for col in _USAGE_COLUMNS)}
+    FROM customers c
+    LEFT JOIN latest l ON l.customer_id = c.customer_id
+    WHERE c.email = :email
+    LIMIT 1
+"""
+ 
+ 
+def _load_plans() -> Optional[List[Dict[str, Any]]]:
+    """All service plans (repeat reads are served by run_query's result cache)."""
+    if not has_table("service_plans"):
+        return None
+    return run_query("SELECT * FROM service_plans")
+ 
+ 
 def _load_customer_profile(customer_email: Optional[str]) -> Dict[str, Any]:
     """
     Load customer record, current plan, last billing-period usage,
     and all available plans from the DB.
+ 
+    Customer + latest usage come back in a single query; both it and the
+    plans read are cached by run_query for a short while.
     """
  
     profile: Dict[str, Any] = {
         "customer": None,
         "current_plan": None,
         "usage": None,
-        "plans": None,
+        "plans": _load_plans(),
     }
  
-    # Load all plans
-    tables = get_tables()
-    if "service_plans" in tables:
-        profile["plans"] = run_query("SELECT * FROM service_plans")
- 
     if not customer_email:
         return profile
  
-    # Load customer details
-    rows = run_query(
-        "SELECT * FROM customers WHERE email = :email LIMIT 1",
-        {"email": customer_email},
-    )
+    # Load customer details (+ latest usage when that table exists)
+    if has_table("customer_usage"):
+        rows = run_query(_CUSTOMER_WITH_USAGE_SQL, {"email": customer_email})
+    else:
+        rows = run_query(
+            "SELECT * FROM customers WHERE email = :email LIMIT 1",
+            {"email": customer_email},
+        )
     if not rows:
         return profile
  
-    customer = rows[0]
+    customer = {k: v for k, v in rows[0].items() if not k.startswith(_USAGE_PREFIX)}
     profile["customer"] = customer
  
+    usage = {
+        k[len(_USAGE_PREFIX):]: v
+        for k, v in rows[0].items()
+        if k.startswith(_USAGE_PREFIX)
+    }
+    if usage.get("usage_id") is not None:
+        profile["usage"] = usage
+ 
     # Load current plan
     if customer.get("service_plan_id") and profile["plans"]:
         plan_id = customer["service_plan_id"]
@@ -54,20 +105,6 @@ def _load_customer_profile(customer_email: Optional[str]) -> Dict[str, Any]:
                 profile["current_plan"] = p
                 break
  
-    # Load latest usage (correct columns + ordering)
-    if "customer_usage" in tables:
-        usage_rows = run_query(
-            """
-            SELECT * FROM customer_usage
-            WHERE customer_id = :cid
-            ORDER BY billing_period_end DESC
-            LIMIT 1
-            """,
-            {"cid": customer["customer_id"]},
-        )
-        if usage_rows:
-            profile["usage"] = usage_rows[0]
- 
     return profile
  
  
@@ -75,22 +112,156 @@ def _load_customer_profile(customer_email: Optional[str]) -> Dict[str, Any]:
 # Format plan for display
 # ---------------------------------------------------------
  
+_PLAN_LINE = "- {name} ({plan_id}): ₹{monthly_cost} / month | {data} | {voice} | {sms}"
+ 
+ 
 def _format_plan(p: dict) -> str:
-    data = "Unlimited" if p["unlimited_data"] else f"{p['data_limit_gb']}GB"
-    voice = "Unlimited" if p["unlimited_voice"] else f"{p['voice_minutes']} min"
-    sms = "Unlimited" if p["unlimited_sms"] else f"{p['sms_count']} SMS"
+    return _PLAN_LINE.format_map(
+        {
+            **p,
+            "data": "Unlimited" if p["unlimited_data"] else f"{p['data_limit_gb']}GB",
+            "voice": "Unlimited" if p["unlimited_voice"] else f"{p['voice_minutes']} min",
+            "sms": "Unlimited" if p["unlimited_sms"] else f"{p['sms_count']} SMS",
+        }
+    )
+ 
+ 
+# ---------------------------------------------------------
+# Plan ranking (deterministic math, done before the LLM)
+# ---------------------------------------------------------
+ 
+# Assumed pay-as-you-go rates for usage beyond a plan's allowance. The DB has
+# no overage tariffs, so bills projected with them are estimates only.
+DATA_OVERAGE_PER_GB = 100.0
+VOICE_OVERAGE_PER_MIN = 1.0
+SMS_OVERAGE_PER_SMS = 0.5
  
-    return (
-        f"- {p['name']} ({p['plan_id']}): ₹{p['monthly_cost']} / month | "
-        f"{data} | {voice} | {sms}"
+# Number of candidate plans passed to the LLM
+TOP_K_PLANS = 3
+ 
+_CHEAPER_RE = re.compile(r"\b(cheap\w*|sav(e|ing)s?|lower|reduce|budget|less)\b", re.IGNORECASE)
+_MORE_DATA_RE = re.compile(r"\b(more data|unlimited|upgrade|heavy|run(ning)? out|exceed\w*)\b", re.IGNORECASE)
+_FAMILY_RE = re.compile(r"\bfamily\b", re.IGNORECASE)
+ 
+ 
+def _limits(plans: List[dict], limit_key: str, unlimited_key: str) -> np.ndarray:
+    """Plan allowances as floats, with unlimited (or missing) limits as +inf."""
+    return np.array(
+        [
+            np.inf if p[unlimited_key] or p[limit_key] is None else float(p[limit_key])
+            for p in plans
+        ]
     )
  
  
+def _rank_plans(
+    plans: List[dict],
+    usage: Optional[Dict[str, Any]],
+    current_plan: Optional[dict],
+    user_query: str,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Project every plan's monthly bill for the customer's usage (vectorized)
+    and return (top candidates, current plan), each plan dict extended with
+    projected_bill, savings_vs_current, fits_usage and estimated_overage.
+ 
+    The user's intent filters the candidates ("cheaper", "more data",
+    "family"). Ranking is: plans that fit the usage first, then by projected
+    bill; for "cheaper" requests, by list price, and every plan with a lower
+    list price than the current one stays a candidate even if its overage
+    makes the projected bill higher.
+    """
+    if not plans:
+        return [], None
+ 
+    cost = np.array([float(p["monthly_cost"]) for p in plans])
+    data_limit = _limits(plans, "data_limit_gb", "unlimited_data")
+    voice_limit = _limits(plans, "voice_minutes", "unlimited_voice")
+    sms_limit = _limits(plans, "sms_count", "unlimited_sms")
+ 
+    usage = usage or {}
+    data_used = float(usage.get("data_used_gb") or 0)
+    voice_used = float(usage.get("voice_minutes_used") or 0)
+    sms_used = float(usage.get("sms_count_used") or 0)
+ 
+    overage = (
+        np.maximum(0.0, data_used - data_limit) * DATA_OVERAGE_PER_GB
+        + np.maximum(0.0, voice_used - voice_limit) * VOICE_OVERAGE_PER_MIN
+        + np.maximum(0.0, sms_used - sms_limit) * SMS_OVERAGE_PER_SMS
+    )
+    projected = cost + overage
+    fits = (data_used <= data_limit) & (voice_used <= voice_limit) & (sms_used <= sms_limit)
+ 
+    current_idx = None
+    if current_plan:
+        current_idx = next(
+            (i for i, p in enumerate(plans) if p["plan_id"] == current_plan["plan_id"]),
+            None,
+        )
+ 
+    if usage.get("total_bill_amount") is not None:
+        current_bill = float(usage["total_bill_amount"])
+    elif current_idx is not None:
+        current_bill = float(projected[current_idx])
+    else:
+        current_bill = None
+ 
+    # Narrow the candidates by intent, but never down to nothing
+    mask = np.ones(len(plans), dtype=bool)
+    if current_idx is not None:
+        mask[current_idx] = False
+ 
+    filters = []
+    if _FAMILY_RE.search(user_query):
+        text = [f"{p['name']} {p.get('description') or ''}".lower() for p in plans]
+        filters.append(np.array(["family" in t for t in text]))
+    if _MORE_DATA_RE.search(user_query) and current_idx is not None:
+        filters.append(data_limit > data_limit[current_idx])
+    cheaper = bool(_CHEAPER_RE.search(user_query))
+    if cheaper and current_bill is not None:
+        lower_price = cost < (cost[current_idx] if current_idx is not None else current_bill)
+        filters.append(lower_price | (projected < current_bill))
+    for f in filters:
+        if (mask & f).any():
+            mask &= f
+ 
+    def _with_features(i: int) -> Dict[str, Any]:
+        return {
+            **plans[i],
+            "projected_bill": round(float(projected[i]), 2),
+            "savings_vs_current": (
+                None if current_bill is None else round(current_bill - float(projected[i]), 2)
+            ),
+            "fits_usage": bool(fits[i]),
+            "estimated_overage": round(float(overage[i]), 2),
+        }
+ 
+    if cheaper:
+        order = np.argsort(cost, kind="stable")
+    else:
+        order = np.lexsort((projected, ~fits))  # last key is the primary sort key
+    candidates = [_with_features(i) for i in order if mask[i]][:TOP_K_PLANS]
+    current = _with_features(current_idx) if current_idx is not None else None
+    return candidates, current
+ 
+ 
+def _format_candidate(p: Dict[str, Any]) -> str:
+    line = _format_plan(p) + f" | est. projected bill ₹{p['projected_bill']:.2f}"
+    if p["savings_vs_current"] is not None:
+        line += f" | est. savings vs current ₹{p['savings_vs_current']:.2f}"
+    if p["fits_usage"]:
+        line += " | fits usage"
+    else:
+        line += f" | would exceed usage limits (est. overage ₹{p['estimated_overage']:.2f})"
+    return line
+ 
+ 
 # ---------------------------------------------------------
-# LangChain LLM builder
+# LangChain LLM (one shared client per process)
 # ---------------------------------------------------------
  
-def _build_llm() -> ChatOpenAI:
+@functools.lru_cache(maxsize=1)
+def _get_llm() -> ChatOpenAI:
     key = get_openai_api_key()
     if not key:
         raise RuntimeError("Missing OPENAI_API_KEY in .env")
@@ -102,28 +273,109 @@ def _build_llm() -> ChatOpenAI:
     )
  
  
+# ---------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------
+ 
+# Recommendations depend on the customer's plan and usage, which can change
+# at any time, so they are kept for a shorter while than docs answers
+RECOMMENDATION_TTL_SECONDS = 600
+ 
+_RECOMMENDATION_CACHE = SemanticCache(ttl_seconds=RECOMMENDATION_TTL_SECONDS)
+ 
+ 
+def _recommendation_cache_key(customer_email: Optional[str], user_query: str):
+    """Recommendations are per customer; live-state questions are never cached."""
+    if customer_email and is_dynamic_query(user_query):
+        return None
+    return ("plan", customer_email), user_query
+ 
+ 
 # ---------------------------------------------------------
 # Personalized Plan Recommendation (Version C)
 # ---------------------------------------------------------
  
-def recommend_personalized_plan(customer_email: Optional[str], user_query: str) -> str:
+# Static system message, identical on every call so OpenAI's automatic
+# prompt-prefix caching applies; all per-request data goes in the user message.
+PLAN_SYSTEM_PROMPT = """
+You are a Telecom Plan Optimization Expert for an Indian telecom operator.
+ 
+You must recommend 1–3 plans based on:
+1. User's request in natural language (e.g., cheaper plan, more data, family plan, add-on packs).
+2. Current plan vs actual usage (data, voice, SMS).
+3. Cost savings or upgrade benefits.
+4. The candidate plans provided, already filtered and ranked for this customer.
+   Their projected bill, savings and overage are estimates based on assumed
+   overage rates: present them as approximate, never as the exact future bill.
+   A plan with a lower monthly cost that would exceed the usage limits is a
+   trade-off; say so rather than leaving it out.
+5. Unlimited data/voice/SMS rules.
+6. Whether the current plan is already ideal.
+ 
+Also consider add-on packs or upgrades if the user is exceeding data/voice/SMS limits.
+If the question is specifically about "add-on packs", clearly list suitable add-on options
+based on their current plan and usage, and explain when they should upgrade the base plan instead.
+ 
+Respond with:
+- A short summary
+- A ranked list of recommended plans and/or add-on packs
+- Reasoning in bullet points
+"""
+
+ 
+# Built once; only the user message is filled in per request
+PLAN_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            PLAN_SYSTEM_PROMPT,
+        ),
+        (
+            "user",
+            """
+User Query:
+{query}
+ 
+Customer:
+{customer_profile}
+ 
+Usage:
+{usage}
+ 
+Candidate Plans (ranked):
+{plans}
+ 
+Provide the best personalized plan/add-on recommendations.
+            """,
+        ),
+    ]
+)
+ 
+ 
+def _build_plan_messages(
+    customer_email: Optional[str],
+    user_query: str,
+    profile: Optional[Dict[str, Any]] = None,
+) -> list:
     """
-    Personalized plan suggestion using:
-    - customer profile
+    Build the chat messages for a personalized plan suggestion using:
+    - customer profile (loaded here unless already given)
     - real usage (from customer_usage)
     - current plan features
-    - all available service_plans
+    - the top service_plans candidates, ranked in Python
     """
  
-    profile = _load_customer_profile(customer_email)
+    if profile is None:
+        profile = _load_customer_profile(customer_email)
  
     plans: List[dict] = profile.get("plans", []) or []
     current_plan = profile.get("current_plan")
     usage = profile.get("usage")
     customer = profile.get("customer")
  
-    # Format plans
-    plan_text = "\n".join(_format_plan(p) for p in plans) if plans else "(No plans)"
+    # Rank plans and keep only the top candidates
+    candidates, current_ranked = _rank_plans(plans, usage, current_plan, user_query)
+    plan_text = "\n".join(_format_candidate(p) for p in candidates) if candidates else "(No plans)"
  
     # Format customer profile
     if customer and current_plan:
@@ -133,6 +385,11 @@ def recommend_personalized_plan(customer_email: Optional[str], user_query: str)
             f"Current Plan: {current_plan['name']} ({current_plan['plan_id']})\n"
             f"Monthly Cost: ₹{current_plan['monthly_cost']}\n"
         )
+        if current_ranked:
+            customer_text += (
+                f"Est. Projected Bill on Current Plan: ₹{current_ranked['projected_bill']:.2f}"
+                f" ({'fits usage' if current_ranked['fits_usage'] else 'exceeds limits'})\n"
+            )
     else:
         customer_text = "No customer profile available.\n"
  
@@ -149,63 +406,50 @@ def recommend_personalized_plan(customer_email: Optional[str], user_query: str)
     else:
         customer_usage_text = "No usage data available.\n"
  
-    llm = _build_llm()
- 
-    # Prompt
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                """
-You are a Telecom Plan Optimization Expert for an Indian telecom operator.
- 
-You must recommend 1–3 plans based on:
-1. User's request in natural language (e.g., cheaper plan, more data, family plan, add-on packs).
-2. Current plan vs actual usage (data, voice, SMS).
-3. Cost savings or upgrade benefits.
-4. All available plans from `service_plans`.
-5. Unlimited data/voice/SMS rules.
-6. Whether the current plan is already ideal.
- 
-Also consider add-on packs or upgrades if the user is exceeding data/voice/SMS limits.
-If the question is specifically about "add-on packs", clearly list suitable add-on options
-based on their current plan and usage, and explain when they should upgrade the base plan instead.
- 
-Respond with:
-- A short summary
-- A ranked list of recommended plans and/or add-on packs
-- Reasoning in bullet points
-                """,
-            ),
-            (
-                "user",
-                """
-User Query:
-{query}
- 
-Customer:
-{customer_profile}
- 
-Usage:
-{usage}
- 
-Available Plans:
-{plans}
- 
-Provide the best personalized plan/add-on recommendations.
-                """,
-            ),
-        ]
-    )
- 
-    messages = prompt.format_messages(
+    return PLAN_PROMPT.format_messages(
         query=user_query,
         customer_profile=customer_text,
         usage=customer_usage_text,
         plans=plan_text,
     )
  
-    response = llm.invoke(messages)
+ 
+@semantic_cache(_RECOMMENDATION_CACHE, key=_recommendation_cache_key)
+def recommend_personalized_plan(customer_email: Optional[str], user_query: str) -> str:
+    """Personalized plan suggestion (see _build_plan_messages for the inputs)."""
+    messages = _build_plan_messages(customer_email, user_query)
+    response = _get_llm().invoke(messages)
     return response.content
  
- 
\ No newline at end of file
+ 
+async def arecommend_personalized_plan(customer_email: Optional[str], user_query: str) -> str:
+    """
+    Async variant of recommend_personalized_plan.
+ 
+    The customer profile is loaded from the DB while the response cache
+    embeds and looks up the query, so on a cache miss the LLM call can
+    start as soon as both are done.
+    """
+ 
+    async def compute() -> str:
+        messages = _build_plan_messages(customer_email, user_query, profile=await profile_task)
+        response = await _get_llm().ainvoke(messages)
+        return response.content
+ 
+    cache_key = _recommendation_cache_key(customer_email, user_query)
+ 
+    try:
+        async with asyncio.TaskGroup() as tg:
+            profile_task = tg.create_task(asyncio.to_thread(_load_customer_profile, customer_email))
+            if cache_key is None:
+                answer_task = tg.create_task(compute())
+            else:
+                namespace, query = cache_key
+                answer_task = tg.create_task(
+                    _RECOMMENDATION_CACHE.aget_or_compute(namespace, query, compute)
+                )
+    except* Exception as group:
+        # Report what actually failed instead of an opaque ExceptionGroup
+        raise group.exceptions[0]
+ 
+    return answer_task.result()
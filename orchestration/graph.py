@@ -1,122 +1,202 @@
 # orchestration/graph.py
 from __future__ import annotations
 
+import asyncio
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 from langgraph.graph import StateGraph, END
 
-from orchestration.state import TelecomAssistantState
-from agents.billing_agents import process_billing_query
-from agents.network_agents import process_network_query
-from agents.service_agents import recommend_personalized_plan
+from orchestration.state import CustomerInfo, TelecomAssistantState
+from agents.billing_agents import aprocess_billing_query
+from agents.network_agents import aprocess_network_query
+from agents.service_agents import arecommend_personalized_plan
 from agents.knowledge_agents import answer_knowledge_query
+from utils.streaming import batch_stream
 
 
 # ---------- Classification & Routing ----------
 
+# Keywords per query type, built once at import.
+# They are matched against whole words of the query and their simple
+# inflections ("billed", "calling", "overcharged"), so "bill" doesn't fire on
+# "billion"; two-word keywords are matched against adjacent word pairs.
+#
+# Specific keywords (_*_KW) name the topic outright; a query runs the backend
+# of every type whose specific keywords it contains, in parallel. Generic
+# keywords (_*_HINTS: "how", "data", "best", ...) show up in questions of
+# any type, so they only pick the one backend when nothing specific matched.
+_BILLING_KW = frozenset(
+    {"bill", "charge", "payment", "due date", "invoice"}
+)
+_BILLING_HINTS = frozenset({"account"})
+_NETWORK_KW = frozenset(
+    {"network", "signal", "connection", "internet", "5g", "4g"}
+)
+_NETWORK_HINTS = frozenset({"call", "data", "slow"})
+_SERVICE_KW = frozenset(
+    {"plan", "recommend", "recommendation", "upgrade", "downgrade", "family", "pack"}
+)
+_SERVICE_HINTS = frozenset({"best"})
+_KNOWLEDGE_KW = frozenset(
+    {"configure", "configuration", "setup", "apn", "volte", "roaming", "esim"}
+)
+_KNOWLEDGE_HINTS = frozenset({"how", "what"})
+
+# (query type, specific keywords, generic keywords), in priority order
+_CLASS_KEYWORDS = (
+    ("billing_account", _BILLING_KW, _BILLING_HINTS),
+    ("network_troubleshooting", _NETWORK_KW, _NETWORK_HINTS),
+    ("service_recommendation", _SERVICE_KW, _SERVICE_HINTS),
+    ("knowledge_retrieval", _KNOWLEDGE_KW, _KNOWLEDGE_HINTS),
+)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+# Inflections stripped from query words before matching: "charges" → "charge",
+# "billed" → "bill", "calling" → "call", "overcharged" → "charged" → "charge"
+_PREFIXES = ("over",)
+_SUFFIXES = ("ing", "ed", "es", "s", "d")
+_MIN_STEM_LENGTH = 3
+
+
+def _word_forms(word: str) -> set:
+    """The word plus its forms with a known prefix and/or suffix removed."""
+    forms = {word}
+    for prefix in _PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= _MIN_STEM_LENGTH:
+            forms.add(word[len(prefix):])
+    for form in list(forms):
+        for suffix in _SUFFIXES:
+            stem = form[: -len(suffix)]
+            if form.endswith(suffix) and len(stem) >= _MIN_STEM_LENGTH:
+                forms.add(stem)
+                if suffix == "ing":
+                    # "charging" → "charge", "configuring" → "configure"
+                    forms.add(stem + "e")
+    return forms
+
+
+def _query_terms(q: str) -> frozenset:
+    """
+    Words of the (lowercased) query, their inflection-free forms and adjacent
+    word pairs in every combination of those forms ("due dates" → "due date").
+    """
+    forms = [_word_forms(word) for word in _WORD_RE.findall(q)]
+    terms = set().union(*forms)
+    for first, second in zip(forms, forms[1:]):
+        terms.update(f"{a} {b}" for a in first for b in second)
+    return frozenset(terms)
+
+
 def classify_query(state: TelecomAssistantState) -> TelecomAssistantState:
-    """Very simple keyword-based classifier (can be upgraded to LLM later)."""
-    q = state["query"].lower()
-    cls = "fallback"
-
-    if any(w in q for w in ["bill", "charge", "payment", "account", "due date", "invoice"]):
-        cls = "billing_account"
-    elif any(w in q for w in ["network", "signal", "connection", "call", "data", "slow", "internet", "5g", "4g"]):
-        cls = "network_troubleshooting"
-    elif any(w in q for w in ["plan", "recommend", "upgrade", "downgrade", "best", "family", "pack"]):
-        cls = "service_recommendation"
-    elif any(w in q for w in ["how", "what", "configure", "setup", "apn", "volte", "roaming", "esim"]):
-        cls = "knowledge_retrieval"
-
-    return {**state, "classification": cls}
-
-
-def route_query(state: TelecomAssistantState) -> str:
-    """Choose which backend node to call based on classification."""
-    cls = state.get("classification", "fallback")
-    if cls == "billing_account":
-        return "crew_ai_node"
-    if cls == "network_troubleshooting":
-        return "autogen_node"
-    if cls == "service_recommendation":
-        return "langchain_node"
-    if cls == "knowledge_retrieval":
-        return "llamaindex_node"
-    return "fallback_handler"
+    """
+    Very simple keyword-based classifier (can be upgraded to LLM later).
+
+    A query can name several types (e.g. "my bill went up and my internet
+    is slow"); all of them are kept, in priority order, and the first one
+    is the main classification. Generic words alone ("how", "data") yield
+    a single type, the first one they match.
+    """
+    terms = _query_terms(state["query"].lower())
+    classes = [cls for cls, keywords, _ in _CLASS_KEYWORDS if terms & keywords]
+    if not classes:
+        classes = [cls for cls, _, hints in _CLASS_KEYWORDS if terms & hints][:1]
+
+    # Nodes return only the keys they change; LangGraph merges them into the state
+    return {
+        "classification": classes[0] if classes else "fallback",
+        "classifications": classes,
+    }
+
+
+_NODE_FOR_CLASS = {
+    "billing_account": "crew_ai_node",
+    "network_troubleshooting": "autogen_node",
+    "service_recommendation": "langchain_node",
+    "knowledge_retrieval": "llamaindex_node",
+}
+
+
+def route_query(state: TelecomAssistantState) -> List[str]:
+    """
+    Choose the backend nodes to call based on classification.
+
+    Returns every matching node; LangGraph runs them in parallel and waits
+    for all of them before formulate_response.
+    """
+    classes = state.get("classifications") or [state.get("classification", "fallback")]
+    nodes = [_NODE_FOR_CLASS[cls] for cls in classes if cls in _NODE_FOR_CLASS]
+    return nodes or ["fallback_handler"]
 
 
 # ---------- Backend Nodes ----------
+# Async so that parallel branches overlap their (network-bound) LLM calls
 
-def crew_ai_node(state: TelecomAssistantState) -> TelecomAssistantState:
+async def crew_ai_node(state: TelecomAssistantState) -> TelecomAssistantState:
     """Handle billing & account queries using CrewAI + telecom.db."""
     query = state["query"]
-    customer_info = state.get("customer_info") or {}
-    customer_identifier = customer_info.get("email") or customer_info.get("id")
+    customer_identifier = state["customer_info"].identifier
 
     try:
-        answer = process_billing_query(customer_identifier=customer_identifier, query=query)
+        answer = await aprocess_billing_query(customer_identifier=customer_identifier, query=query)
     except Exception as e:
         answer = (
             "Sorry, I ran into a problem while analyzing your billing question.\n\n"
             f"Technical details: {type(e).__name__}: {e}"
         )
 
-    return {
-        **state,
-        "intermediate_responses": {"crew_ai": answer},
-    }
+    return {"intermediate_responses": {"crew_ai": answer}}
 
 
-def autogen_node(state: TelecomAssistantState) -> TelecomAssistantState:
+async def autogen_node(state: TelecomAssistantState) -> TelecomAssistantState:
     """Handle network troubleshooting queries using our 2-agent network workflow."""
     query = state["query"]
-    customer_info = state.get("customer_info") or {}
-    customer_identifier = customer_info.get("email") or customer_info.get("id")
+    customer_identifier = state["customer_info"].identifier
 
     try:
-        answer = process_network_query(query, customer_identifier)
+        answer = await aprocess_network_query(query, customer_identifier)
     except Exception as e:
         answer = (
             "Sorry, I ran into a problem while diagnosing your network issue.\n\n"
             f"Technical details: {type(e).__name__}: {e}"
         )
 
-    return {
-        **state,
-        "intermediate_responses": {"autogen": answer},
-    }
+    return {"intermediate_responses": {"autogen": answer}}
 
 
-def langchain_node(state: TelecomAssistantState) -> TelecomAssistantState:
+async def langchain_node(state: TelecomAssistantState) -> TelecomAssistantState:
     """Handle plan recommendations using LangChain + real DB data."""
     query = state["query"]
-    customer_info = state.get("customer_info") or {}
-    customer_email = customer_info.get("email")
+    customer_email = state["customer_info"].email
 
     try:
-        answer = recommend_personalized_plan(customer_email, query)
+        answer = await arecommend_personalized_plan(customer_email, query)
     except Exception as e:
         answer = (
             "Sorry, I had trouble generating a plan recommendation.\n\n"
             f"Technical details: {type(e).__name__}: {e}"
         )
 
-    return {
-        **state,
-        "intermediate_responses": {"langchain": answer},
-    }
+    return {"intermediate_responses": {"langchain": answer}}
 
 
-def llamaindex_node(state: TelecomAssistantState) -> TelecomAssistantState:
+async def llamaindex_node(state: TelecomAssistantState) -> TelecomAssistantState:
     """Handle knowledge / how-to questions using LlamaIndex over docs."""
     query = state["query"]
-    customer_info = state.get("customer_info") or {}
-    customer_email = customer_info.get("email")
+    customer_email = state["customer_info"].email
 
-    answer = answer_knowledge_query(query, customer_email)
+    # LlamaIndex query engine is blocking; keep it off the event loop
+    answer = await asyncio.to_thread(answer_knowledge_query, query, customer_email)
 
-    return {
-        **state,
-        "intermediate_responses": {"llamaindex": answer},
-    }
+    return {"intermediate_responses": {"llamaindex": answer}}
 
 
 def fallback_handler(state: TelecomAssistantState) -> TelecomAssistantState:
@@ -129,26 +209,106 @@ def fallback_handler(state: TelecomAssistantState) -> TelecomAssistantState:
         "- Plan recommendations (upgrade/downgrade, family plans)\n"
         "- Technical how-to (APN settings, VoLTE, roaming, eSIM)"
     )
-    return {**state, "intermediate_responses": {"fallback": txt}}
+    return {"intermediate_responses": {"fallback": txt}}
 
 
 # ---------- Response Aggregation ----------
 
+# Backend responses in the order they are shown (same priority as the
+# classification), with the section header used when several answered
+_PRIORITY = ("crew_ai", "autogen", "langchain", "llamaindex", "fallback")
+_SECTION_TITLES = {
+    "crew_ai": "Billing & Account",
+    "autogen": "Network Support",
+    "langchain": "Plan Recommendation",
+    "llamaindex": "Technical Support",
+    "fallback": "Help",
+}
+
+
 def formulate_response(state: TelecomAssistantState) -> TelecomAssistantState:
-    """Pick the backend's answer and store it as final_response."""
+    """
+    Combine the backends' answers and store them as final_response.
+
+    Parallel branches finish in any order, so the answers are merged by
+    _PRIORITY rather than by arrival: a single answer is used as is,
+    several are joined under section headers.
+    """
     responses = state.get("intermediate_responses", {})
-    if responses:
-        # just pick the first backend response for now
-        final = next(iter(responses.values()))
+    answered = [key for key in _PRIORITY if key in responses]
+    if len(answered) == 1:
+        final = str(responses[answered[0]])
+    elif answered:
+        final = "\n\n".join(
+            f"## {_SECTION_TITLES[key]}\n\n{responses[key]}" for key in answered
+        )
     else:
         final = "Something went wrong while generating a response."
-    return {**state, "final_response": final}
+    return {"final_response": final}
+
+
+# ---------- Checkpointing ----------
+
+# Conversations whose latest state is kept in memory (least recently used go first)
+MAX_CHECKPOINT_THREADS = 1000
+
+
+class LatestCheckpointSaver(MemorySaver):
+    """
+    MemorySaver that keeps only the newest checkpoint of each thread, for at
+    most `max_threads` threads.
+
+    A plain MemorySaver keeps every step of every conversation forever; the
+    assistant only ever continues from the latest one.
+    """
+
+    def __init__(self, *, max_threads: int = MAX_CHECKPOINT_THREADS, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self._threads: "OrderedDict[str, None]" = OrderedDict()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = next_config["configurable"]["thread_id"]
+        checkpoint_ns = next_config["configurable"]["checkpoint_ns"]
+
+        # Drop the older checkpoints of this thread, their pending writes and
+        # the channel values only they referenced
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [cid for cid in checkpoints if cid != checkpoint["id"]]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        live_versions = checkpoint["channel_versions"]
+        stale_blobs = [
+            key
+            for key in self.blobs
+            if key[:2] == (thread_id, checkpoint_ns) and live_versions.get(key[2]) != key[3]
+        ]
+        for key in stale_blobs:
+            del self.blobs[key]
+
+        self._threads[thread_id] = None
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > self.max_threads:
+            oldest, _ = self._threads.popitem(last=False)
+            self.delete_thread(oldest)
+
+        return next_config
 
 
 # ---------- Graph Factory ----------
 
 def create_graph():
-    """Build and compile the LangGraph workflow."""
+    """
+    Build and compile the LangGraph workflow.
+
+    The backend nodes are async: run the graph with ainvoke (or
+    invoke_graph from sync code).
+
+    The latest state of each conversation is checkpointed in memory
+    (see LatestCheckpointSaver): pass {"configurable": {"thread_id": ...}}
+    as the run config.
+    """
     workflow = StateGraph(TelecomAssistantState)
 
     # Nodes
@@ -160,7 +320,7 @@ def create_graph():
     workflow.add_node("fallback_handler", fallback_handler)
     workflow.add_node("formulate_response", formulate_response)
 
-    # Routing after classification
+    # Routing after classification (fan-out: route_query may pick several nodes)
     workflow.add_conditional_edges(
         "classify_query",
         route_query,
@@ -174,6 +334,7 @@ def create_graph():
     )
 
     # After backend nodes → formulate_response → END
+    # (formulate_response runs once all parallel branches have finished)
     workflow.add_edge("crew_ai_node", "formulate_response")
     workflow.add_edge("autogen_node", "formulate_response")
     workflow.add_edge("langchain_node", "formulate_response")
@@ -184,4 +345,136 @@ def create_graph():
     # Entry point
     workflow.set_entry_point("classify_query")
 
-    return workflow.compile()
+    # CustomerInfo is part of the checkpointed state; allow it back in explicitly
+    checkpointer = LatestCheckpointSaver(
+        serde=JsonPlusSerializer(
+            allowed_msgpack_modules=[(CustomerInfo.__module__, CustomerInfo.__name__)]
+        )
+    )
+    return workflow.compile(checkpointer=checkpointer)
+
+
+# ---------- Sync Entry Point ----------
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide event loop the graph runs on (daemon thread).
+
+    One long-lived loop instead of asyncio.run() per query: the async
+    HTTP clients of the agents keep their connection pools bound to it.
+    """
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="graph-loop", daemon=True).start()
+            _LOOP = loop
+    return _LOOP
+
+
+# Upper bound for one query through the whole graph
+GRAPH_TIMEOUT_SECONDS = 300
+
+
+def invoke_graph(
+    graph,
+    state: TelecomAssistantState,
+    thread_id: str = "anon",
+    timeout: Optional[float] = GRAPH_TIMEOUT_SECONDS,
+) -> TelecomAssistantState:
+    """
+    Run graph.ainvoke(state) from sync code (e.g. Streamlit) and wait for the result.
+
+    `thread_id` selects the conversation whose checkpointed state is continued.
+    Raises TimeoutError (and cancels the run) after `timeout` seconds.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    future = asyncio.run_coroutine_threadsafe(
+        graph.ainvoke(state, config=config), _get_loop()
+    )
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+# ---------- Streaming Entry Point ----------
+
+_BACKEND_NODES = frozenset(_NODE_FOR_CLASS.values())
+_STREAM_DONE = object()
+
+
+async def _astream_answer(graph, state: TelecomAssistantState, config: dict) -> AsyncIterator[str]:
+    """
+    Yield the answer of one graph run as it is produced.
+
+    When the query goes to a single backend, the tokens of the LangChain chat
+    models it calls are yielded as they arrive. Otherwise (several backends
+    to merge, cached answers, non-LangChain backends) final_response is
+    yielded whole once formulate_response has run.
+    """
+    single_route = False
+    streamed = False
+    async for mode, payload in graph.astream(
+        state, config=config, stream_mode=["updates", "messages"]
+    ):
+        if mode == "messages":
+            chunk, metadata = payload
+            if single_route and metadata.get("langgraph_node") in _BACKEND_NODES and chunk.content:
+                streamed = True
+                yield chunk.content
+        elif "classify_query" in payload:
+            single_route = len(route_query(payload["classify_query"])) == 1
+        elif "formulate_response" in payload and not streamed:
+            yield payload["formulate_response"]["final_response"]
+
+
+def stream_graph(
+    graph,
+    state: TelecomAssistantState,
+    thread_id: str = "anon",
+    timeout: Optional[float] = GRAPH_TIMEOUT_SECONDS,
+) -> Iterator[str]:
+    """
+    Streaming variant of invoke_graph: run the graph on the shared loop and
+    yield the answer text in growing batches (see _astream_answer).
+
+    Raises TimeoutError (and cancels the run) after `timeout` seconds; the
+    run is also cancelled if the caller stops iterating.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    chunks: "queue.Queue[Any]" = queue.Queue()
+
+    async def produce() -> None:
+        try:
+            async for text in _astream_answer(graph, state, config):
+                chunks.put(text)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(_STREAM_DONE)
+
+    def drain() -> Iterator[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = chunks.get(timeout=remaining)
+            except queue.Empty:
+                raise TimeoutError(f"graph run exceeded {timeout}s") from None
+            if item is _STREAM_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    future = asyncio.run_coroutine_threadsafe(produce(), _get_loop())
+    try:
+        yield from batch_stream(drain())
+    finally:
+        future.cancel()
@@ -1,7 +1,33 @@
 # orchestration/state.py
 from __future__ import annotations
 
-from typing import TypedDict, Dict, Any, List
+from dataclasses import dataclass
+from typing import Annotated, TypedDict, Dict, Any, List, Optional
+
+
+@dataclass(slots=True, frozen=True)
+class CustomerInfo:
+    """Logged-in customer, as known by the UI."""
+    email: Optional[str] = None
+    id: Optional[str] = None
+
+    @property
+    def identifier(self) -> Optional[str]:
+        """Whatever identifies the customer in the DB: email, else customer id."""
+        return self.email or self.id
+
+
+def merge_responses(current: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reducer for intermediate_responses.
+
+    Parallel nodes' entries are merged. An empty update (the input of a new
+    query) clears the previous query's answers, which would otherwise be
+    carried over by the checkpointer.
+    """
+    if not update:
+        return {}
+    return {**current, **update}
 
 
 class TelecomAssistantState(TypedDict):
@@ -10,15 +36,20 @@ class TelecomAssistantState(TypedDict):
 
     Fields:
       - query: The user's latest query/message.
-      - customer_info: Info from login (email, id, etc.).
+      - customer_info: Info from login (email, id).
       - classification: High-level type of query (billing, network, etc.).
-      - intermediate_responses: Raw responses from backend agents.
+      - classifications: Every type the query matched, in priority order;
+        each one's backend node runs in parallel.
+      - intermediate_responses: Raw responses from backend agents. Nodes
+        running in parallel each return their own entry; the dicts are
+        merged (merge_responses) instead of overwriting each other.
       - final_response: The message that will be shown in the UI.
       - chat_history: Simple list of previous user/assistant messages.
     """
     query: str
-    customer_info: Dict[str, Any]
+    customer_info: CustomerInfo
     classification: str
-    intermediate_responses: Dict[str, Any]
+    classifications: List[str]
+    intermediate_responses: Annotated[Dict[str, Any], merge_responses]
     final_response: str
     chat_history: List[Dict[str, str]]
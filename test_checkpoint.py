@@ -0,0 +1,74 @@
+# test_checkpoint.py
+# orchestration.graph.LatestCheckpointSaver prunes MemorySaver's internal
+# storage / writes / blobs, which langgraph-checkpoint may change between
+# releases; these checks fail loudly if pruning or resuming breaks.
+# Run with `python test_checkpoint.py` or pytest.
+import operator
+from typing import Annotated, TypedDict
+
+from langgraph.graph import END, StateGraph
+
+from orchestration.graph import LatestCheckpointSaver
+
+
+class CounterState(TypedDict):
+    turns: Annotated[int, operator.add]
+    last: str
+
+
+def _step(state: CounterState) -> dict:
+    return {"turns": 1, "last": f"turn {state['turns'] + 1}"}
+
+
+def _graph(saver: LatestCheckpointSaver):
+    workflow = StateGraph(CounterState)
+    workflow.add_node("first", _step)
+    workflow.add_node("second", _step)
+    workflow.set_entry_point("first")
+    workflow.add_edge("first", "second")
+    workflow.add_edge("second", END)
+    return workflow.compile(checkpointer=saver)
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _checkpoint_count(saver: LatestCheckpointSaver, thread_id: str) -> int:
+    return sum(1 for _ in saver.list(_config(thread_id)))
+
+
+def test_keeps_one_checkpoint_per_thread():
+    saver = LatestCheckpointSaver()
+    graph = _graph(saver)
+    for _ in range(3):
+        graph.invoke({"turns": 0}, _config("t1"))
+    assert _checkpoint_count(saver, "t1") == 1
+
+
+def test_resumes_from_latest_state():
+    saver = LatestCheckpointSaver()
+    graph = _graph(saver)
+    graph.invoke({"turns": 0}, _config("t1"))
+    result = graph.invoke({"turns": 0}, _config("t1"))
+    # Two nodes per run, continued from the checkpointed total
+    assert result["turns"] == 4, result
+    assert graph.get_state(_config("t1")).values == result
+
+
+def test_evicts_least_recently_used_threads():
+    saver = LatestCheckpointSaver(max_threads=2)
+    graph = _graph(saver)
+    for thread_id in ("t1", "t2", "t1", "t3"):
+        graph.invoke({"turns": 0}, _config(thread_id))
+    assert _checkpoint_count(saver, "t2") == 0
+    assert _checkpoint_count(saver, "t1") == 1
+    assert _checkpoint_count(saver, "t3") == 1
+    assert graph.get_state(_config("t1")).values["turns"] == 4
+
+
+if __name__ == "__main__":
+    test_keeps_one_checkpoint_per_thread()
+    test_resumes_from_latest_state()
+    test_evicts_least_recently_used_threads()
+    print("checkpoint pruning: OK")
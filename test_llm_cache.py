@@ -0,0 +1,77 @@
+# test_llm_cache.py
+# Regression pairs for utils.llm_cache.SemanticCache: queries that embed
+# almost identically but must never be served each other's answer, plus
+# paraphrases that may. Embeddings are faked to be identical, so only the
+# cache's own checks keep the pairs apart.
+# Run with `python test_llm_cache.py` or pytest.
+import time
+
+from utils.llm_cache import HAS_FAISS, SemanticCache, contrast_terms
+
+# (cached query, new query): must be a semantic miss
+MUST_NOT_MATCH = [
+    ("How do I enable VoLTE?", "How do I disable VoLTE?"),
+    ("How to activate international roaming?", "How to deactivate international roaming?"),
+    ("Turn on roaming", "Turn off roaming"),
+    ("Explain my May bill", "Explain my June bill"),
+    ("Why is my bill 799?", "Why is my bill 1299?"),
+    ("I want to upgrade my plan", "I want to downgrade my plan"),
+    ("Which plan has more data?", "Which plan has less data?"),
+    ("Calls are not working", "Calls are working"),
+    ("Incoming calls drop", "Outgoing calls drop"),
+    ("5G is slow", "4G is slow"),
+]
+
+# (cached query, new query): may be served from the semantic tier
+MAY_MATCH = [
+    ("How do I enable VoLTE?", "how can I enable volte on my phone"),
+    ("What are the APN settings?", "Tell me the APN settings"),
+]
+
+
+def _identical_embedding(query):
+    return [1.0, 0.0, 0.0]
+
+
+def _cache(**kwargs):
+    return SemanticCache(embed_fn=_identical_embedding, **kwargs)
+
+
+def test_contrast_pairs_never_match():
+    if not HAS_FAISS:
+        return
+    for cached, new in MUST_NOT_MATCH:
+        cache = _cache()
+        cache.get_or_compute("ns", cached, lambda: cached)
+        assert cache.get_or_compute("ns", new, lambda: new) == new, (cached, new)
+
+
+def test_paraphrases_match():
+    if not HAS_FAISS:
+        return
+    for cached, new in MAY_MATCH:
+        cache = _cache()
+        cache.get_or_compute("ns", cached, lambda: cached)
+        assert cache.get_or_compute("ns", new, lambda: new) == cached, (cached, new)
+
+
+def test_contrast_terms():
+    assert contrast_terms("how do i enable volte") == {"enable"}
+    assert contrast_terms("my bill for may is 799") == {"may", "799"}
+    assert contrast_terms("what are the apn settings") == set()
+
+
+def test_entries_expire():
+    cache = SemanticCache(ttl_seconds=0.05, embed_fn=None)
+    cache.get_or_compute("ns", "q", lambda: "old")
+    assert cache.get_or_compute("ns", "q", lambda: "new") == "old"
+    time.sleep(0.1)
+    assert cache.get_or_compute("ns", "q", lambda: "new") == "new"
+
+
+if __name__ == "__main__":
+    test_contrast_pairs_never_match()
+    test_paraphrases_match()
+    test_contrast_terms()
+    test_entries_expire()
+    print("semantic cache regression pairs: OK")
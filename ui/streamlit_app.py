@@ -1,29 +1,84 @@
 # ui/streamlit_app.py
 
-import sys
-from pathlib import Path
-from typing import TypedDict, List, Dict, Any
+from typing import TypedDict, List, Dict, Any, Iterator
 
 import streamlit as st
 import pandas as pd
 
-# ---------------------------------------------------------------------
-# 1. Make sure we can import from project root (.. = parent of ui/)
-# ---------------------------------------------------------------------
-PROJECT_ROOT = Path(__file__).parent.parent
-if str(PROJECT_ROOT) not in sys.path:
-    sys.path.insert(0, str(PROJECT_ROOT))
+# The project packages come from the installed project (`pip install -e .`),
+# or from the project root when started via `streamlit run app.py`
+from orchestration.graph import create_graph, stream_graph, CustomerInfo, TelecomAssistantState
+
+
+# Only the most recent turns are sent along with a query; the full history
+# stays in the session and is never copied into the graph state.
+CHAT_HISTORY_WINDOW = 4
+
+# Messages rendered in the chat tab; older ones only on request
+CHAT_DISPLAY_WINDOW = 20
 
-# Now these imports should work as long as your project structure is:
-# Project/
-#   orchestration/
-#   ui/
-from orchestration.graph import create_graph, TelecomAssistantState
+
+# Demo data shown in the dashboards; static, so built once at import
+# instead of on every rerun
+_STATUS_DF = pd.DataFrame(
+    {
+        "Region": ["Mumbai", "Delhi", "Bangalore", "Chennai", "Hyderabad"],
+        "4G Status": ["Normal", "Normal", "Degraded", "Normal", "Normal"],
+        "5G Status": ["Normal", "Maintenance", "Normal", "Normal", "Degraded"],
+    }
+)
+
+_DOC_DF = pd.DataFrame(
+    {
+        "Document Name": [
+            "Service Plans Guide.md",
+            "Network Troubleshooting Guide.md",
+            "Billing FAQs.md",
+            "Technical Support Guide.md",
+        ],
+        "Type": ["Markdown"] * 4,
+        "Last Updated": ["2023-06-20", "2023-06-18", "2023-06-15", "2023-06-10"],
+    }
+)
+
+_TICKET_DF = pd.DataFrame(
+    {
+        "Ticket ID": ["TKT004", "TKT005"],
+        "Customer": ["Ananya Singh", "Vikram Reddy"],
+        "Issue": ["Account reactivation", "Slow internet speeds"],
+        "Status": ["In Progress", "Assigned"],
+        "Priority": ["Medium", "Medium"],
+        "Created": ["2023-06-15", "2023-06-17"],
+    }
+)
+
+_INCIDENT_DF = pd.DataFrame(
+    {
+        "Incident ID": ["INC003"],
+        "Type": ["Equipment Failure"],
+        "Location": ["Delhi West"],
+        "Affected Services": ["Voice, Data, SMS"],
+        "Started": ["2023-06-15 08:15:00"],
+        "Status": ["In Progress"],
+        "Severity": ["Critical"],
+    }
+)
 
 
 # ---------------------------------------------------------------------
-# 2. Session initialization
+# 1. Session initialization
 # ---------------------------------------------------------------------
+@st.cache_resource(show_spinner=False)
+def _build_graph():
+    """
+    Compile the LangGraph workflow once per process, shared by all sessions.
+
+    Exceptions are not cached by st.cache_resource, so if creation fails a
+    later session tries again.
+    """
+    return create_graph()
+
+
 def init_session() -> None:
     """Initialize keys in Streamlit session state."""
     if "authenticated" not in st.session_state:
@@ -34,55 +89,58 @@ def init_session() -> None:
         st.session_state.email = None
     if "chat_history" not in st.session_state:
         st.session_state.chat_history: List[Dict[str, str]] = []
+    if "show_earlier_messages" not in st.session_state:
+        st.session_state.show_earlier_messages = False
 
-    # Initialize graph only once
-    if "graph" not in st.session_state:
+    # Check the shared graph once per session
+    if "graph_loaded" not in st.session_state:
         try:
-            st.session_state.graph = create_graph()
+            _build_graph()
             st.session_state.graph_loaded = True
             st.session_state.graph_error = None
         except Exception as e:
             st.session_state.graph_loaded = False
             st.session_state.graph_error = str(e)
-            st.session_state.graph = None
 
 
 # ---------------------------------------------------------------------
-# 3. Helper to run LangGraph flow
+# 2. Helper to run LangGraph flow
 # ---------------------------------------------------------------------
-def run_query_through_graph(query: str) -> str:
-    """Send a query through our LangGraph workflow and return the final response."""
+def stream_query_through_graph(query: str) -> Iterator[str]:
+    """Send a query through our LangGraph workflow and yield the response as it arrives."""
 
     # If graph failed to initialize, don't crash – show a friendly message
-    if not st.session_state.get("graph_loaded", False) or st.session_state.graph is None:
+    if not st.session_state.get("graph_loaded", False):
         error_msg = st.session_state.get(
             "graph_error",
             "Graph is not initialized. Please check backend / database configuration.",
         )
-        return f"⚠️ System initialization error: {error_msg}"
+        yield f"⚠️ System initialization error: {error_msg}"
+        return
 
     # Prepare state for LangGraph
     state: TelecomAssistantState = {
         "query": query,
-        "customer_info": {"email": st.session_state.email},
+        "customer_info": CustomerInfo(email=st.session_state.email),
         "classification": "",
         "intermediate_responses": {},
         "final_response": "",
-        "chat_history": st.session_state.chat_history,
+        "chat_history": st.session_state.chat_history[-CHAT_HISTORY_WINDOW:],
     }
 
     try:
-        result: TelecomAssistantState = st.session_state.graph.invoke(state)
+        # Backend nodes are async; parallel branches overlap their LLM calls,
+        # and a single backend's tokens are streamed as they are generated
+        yield from stream_graph(
+            _build_graph(), state, thread_id=st.session_state.email or "anon"
+        )
     except Exception as e:
         # If your database / agents fail, you'll see the error here
-        return f"❌ Error while processing your request (possible DB/agent issue): {e}"
-
-    # Fall back if the key is missing
-    return result.get("final_response", "I couldn't generate a response.")
+        yield f"❌ Error while processing your request (possible DB/agent issue): {e}"
 
 
 # ---------------------------------------------------------------------
-# 4. Sidebar login / logout
+# 3. Sidebar login / logout
 # ---------------------------------------------------------------------
 def sidebar_login() -> None:
     with st.sidebar:
@@ -121,7 +179,7 @@ def sidebar_login() -> None:
 
 
 # ---------------------------------------------------------------------
-# 5. Customer view
+# 4. Customer view
 # ---------------------------------------------------------------------
 def customer_view() -> None:
     st.title("Welcome to Telecom Service Assistant")
@@ -132,8 +190,16 @@ def customer_view() -> None:
     with tab1:
         st.header("Chat with our AI Assistant")
 
-        # Show previous messages
-        for msg in st.session_state.chat_history:
+        # Show previous messages: only the latest ones, unless the user asks
+        # for the rest, so a rerun doesn't redraw the whole conversation
+        history = st.session_state.chat_history
+        shown = history
+        if len(history) > CHAT_DISPLAY_WINDOW:
+            hidden = len(history) - CHAT_DISPLAY_WINDOW
+            st.toggle(f"Show {hidden} earlier messages", key="show_earlier_messages")
+            if not st.session_state.show_earlier_messages:
+                shown = history[-CHAT_DISPLAY_WINDOW:]
+        for msg in shown:
             with st.chat_message(msg["role"]):
                 st.write(msg["content"])
 
@@ -146,11 +212,10 @@ def customer_view() -> None:
             with st.chat_message("user"):
                 st.write(prompt)
 
-            # Model response
+            # Model response, streamed as the graph produces it
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
-                    response = run_query_through_graph(prompt)
-                    st.write(response)
+                    response = st.write_stream(stream_query_through_graph(prompt))
 
             # Add assistant response to history
             st.session_state.chat_history.append(
@@ -178,21 +243,14 @@ def customer_view() -> None:
     # ---- Network Status tab (demo data) ----
     with tab3:
         st.header("Network Status")
-        status_df = pd.DataFrame(
-            {
-                "Region": ["Mumbai", "Delhi", "Bangalore", "Chennai", "Hyderabad"],
-                "4G Status": ["Normal", "Normal", "Degraded", "Normal", "Normal"],
-                "5G Status": ["Normal", "Maintenance", "Normal", "Normal", "Degraded"],
-            }
-        )
-        st.dataframe(status_df, use_container_width=True)
+        st.dataframe(_STATUS_DF, use_container_width=True)
         st.subheader("Known Issues")
         st.info("Scheduled maintenance in Delhi region (03:00–05:00 AM)")
         st.warning("Network congestion reported in Bangalore South")
 
 
 # ---------------------------------------------------------------------
-# 6. Admin view
+# 5. Admin view
 # ---------------------------------------------------------------------
 def admin_view() -> None:
     st.title("Admin Dashboard")
@@ -220,34 +278,12 @@ def admin_view() -> None:
                 )
 
         st.subheader("Existing Documents")
-        doc_df = pd.DataFrame(
-            {
-                "Document Name": [
-                    "Service Plans Guide.md",
-                    "Network Troubleshooting Guide.md",
-                    "Billing FAQs.md",
-                    "Technical Support Guide.md",
-                ],
-                "Type": ["Markdown"] * 4,
-                "Last Updated": ["2023-06-20", "2023-06-18", "2023-06-15", "2023-06-10"],
-            }
-        )
-        st.dataframe(doc_df, use_container_width=True)
+        st.dataframe(_DOC_DF, use_container_width=True)
 
     # ---- Support tab ----
     with tab2:
         st.header("Customer Support Dashboard")
-        ticket_df = pd.DataFrame(
-            {
-                "Ticket ID": ["TKT004", "TKT005"],
-                "Customer": ["Ananya Singh", "Vikram Reddy"],
-                "Issue": ["Account reactivation", "Slow internet speeds"],
-                "Status": ["In Progress", "Assigned"],
-                "Priority": ["Medium", "Medium"],
-                "Created": ["2023-06-15", "2023-06-17"],
-            }
-        )
-        st.dataframe(ticket_df, use_container_width=True)
+        st.dataframe(_TICKET_DF, use_container_width=True)
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -260,22 +296,11 @@ def admin_view() -> None:
     # ---- Network monitoring tab ----
     with tab3:
         st.header("Network Monitoring")
-        incident_df = pd.DataFrame(
-            {
-                "Incident ID": ["INC003"],
-                "Type": ["Equipment Failure"],
-                "Location": ["Delhi West"],
-                "Affected Services": ["Voice, Data, SMS"],
-                "Started": ["2023-06-15 08:15:00"],
-                "Status": ["In Progress"],
-                "Severity": ["Critical"],
-            }
-        )
-        st.dataframe(incident_df, use_container_width=True)
+        st.dataframe(_INCIDENT_DF, use_container_width=True)
 
 
 # ---------------------------------------------------------------------
-# 7. Main entry point
+# 6. Main entry point
 # ---------------------------------------------------------------------
 def main() -> None:
     st.set_page_config(
@@ -1,11 +1,17 @@
 # utils/database.py
 from __future__ import annotations
 
+import functools
+import os
+import re
+import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.elements import TextClause
 
 
 # Base directory of the project
@@ -14,6 +20,38 @@ BASE_DIR = Path(__file__).parent.parent
 # Path to the SQLite database
 DB_PATH = BASE_DIR / "data" / "telecom.db"
 
+# Connection pool sizing for run_query (agents probe tables concurrently)
+POOL_SIZE = 16
+POOL_RECYCLE_SECONDS = 300
+
+# Distinct SQL strings whose text() construct is kept for reuse
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every new SQLite connection of the pooled engines: the
+# 256 MB mmap / 64 MB page cache keep the whole DB in memory.
+SQLITE_PRAGMAS = (
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Added with SQLITE_WAL=1: WAL lets the agents' concurrent readers proceed
+# while a write is in progress. It is opt-in because switching the journal
+# mode rewrites the DB file, and the bundled data/telecom.db is tracked in git.
+SQLITE_WAL_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+)
+
+# Rows fetched per round trip by run_query_iter
+ITER_BATCH_SIZE = 256
+
+# Read-only SELECT results kept by run_query_cached. Entries are dropped on
+# any write through run_query, and expire after the TTL so changes made by
+# other processes are picked up too.
+QUERY_CACHE_SIZE = 512
+QUERY_CACHE_TTL_SECONDS = 60
+
 
 def get_db_path() -> Path:
     """Return the path to the telecom SQLite database."""
@@ -25,32 +63,283 @@ def get_db_uri() -> str:
     return f"sqlite:///{get_db_path().as_posix()}"
 
 
+def get_db_read_uri() -> str:
+    """
+    Return the connection URI used for read-only queries.
+
+    Set DB_READ_URI to point reads at a replica; defaults to the main DB.
+    """
+    return os.getenv("DB_READ_URI", get_db_uri())
+
+
+def _needs_pre_ping(uri: str) -> bool:
+    """
+    Only network databases need a liveness ping on checkout. A pooled SQLite
+    connection is an open file handle that can't go stale, so pinging it
+    would just add a `SELECT 1` to every query.
+    """
+    return not uri.startswith("sqlite")
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """SQLAlchemy "connect" hook: run SQLITE_PRAGMAS once per new connection."""
+    pragmas = SQLITE_PRAGMAS
+    if os.getenv("SQLITE_WAL") == "1":
+        pragmas = SQLITE_WAL_PRAGMAS + pragmas
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            try:
+                cursor.execute(pragma)
+            except Exception:
+                # e.g. a read-only DB file can't switch to WAL; keep the defaults
+                pass
+    finally:
+        cursor.close()
+
+
+def _set_query_only(dbapi_connection, connection_record) -> None:
+    """SQLAlchemy "connect" hook for read engine connections: refuse writes."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA query_only=1")
+    finally:
+        cursor.close()
+
+
+def _create_pooled_engine(uri: str, **kwargs: Any) -> Engine:
+    engine = create_engine(
+        uri,
+        future=True,
+        pool_size=POOL_SIZE,
+        pool_pre_ping=_needs_pre_ping(uri),
+        **kwargs,
+    )
+    if uri.startswith("sqlite"):
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
 def get_engine(echo: bool = False) -> Engine:
-    """Create and return a SQLAlchemy engine for the telecom DB."""
-    return create_engine(get_db_uri(), echo=echo, future=True)
+    """
+    Return the process-wide SQLAlchemy engine for the telecom DB.
+
+    Created once (per `echo` setting) and shared by every caller and thread,
+    instead of a new engine, pool and dialect per call. For SQLite all
+    threads share one connection (StaticPool) carrying the tuned PRAGMAs.
+    """
+    uri = get_db_uri()
+    if not uri.startswith("sqlite"):
+        return create_engine(uri, echo=echo, future=True)
+
+    engine = create_engine(
+        uri,
+        echo=echo,
+        future=True,
+        poolclass=StaticPool,
+        pool_pre_ping=False,
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    return engine
 
 
-def run_query(query: str, params: dict = None) -> List[Dict[str, Any]]:
+@functools.lru_cache(maxsize=1)
+def _get_query_engine() -> Engine:
+    """Process-wide pooled engine for run_query writes (primary DB)."""
+    return _create_pooled_engine(get_db_uri())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_read_engine() -> Engine:
+    """
+    Process-wide pooled engine for read-only run_query calls (replica, if configured).
+
+    Its SQLite connections are marked query_only, so a stray write through
+    a read path fails instead of taking the write lock.
+    """
+    uri = get_db_read_uri()
+    engine = _create_pooled_engine(uri, pool_recycle=POOL_RECYCLE_SECONDS)
+    if uri.startswith("sqlite"):
+        # Registered after the PRAGMA hook, so an opt-in journal_mode=WAL is still applied first
+        event.listen(engine, "connect", _set_query_only)
+    return engine
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _statement(query: str) -> TextClause:
+    """text() construct for a SQL string, reused so SQLAlchemy's compiled cache hits."""
+    return text(query)
+
+
+_READ_RE = re.compile(r"\s*(select|with)\b", re.IGNORECASE)
+_WRITE_RE = re.compile(r"\s*(insert|update|delete|replace|create|drop|alter)\b", re.IGNORECASE)
+_WITH_RE = re.compile(r"\s*with\b", re.IGNORECASE)
+# DML inside a WITH statement, e.g. "WITH x AS (...) DELETE FROM t ..."
+_CTE_WRITE_RE = re.compile(
+    r"\b(insert\s+(or\s+\w+\s+)?into|replace\s+into|delete\s+from|update(\s+or\s+\w+)?\s+\S+\s+set)\b",
+    re.IGNORECASE,
+)
+
+
+def _is_write(sql: str) -> bool:
+    """True for statements that change data or schema (and so stale the query cache)."""
+    if _WRITE_RE.match(sql):
+        return True
+    return bool(_WITH_RE.match(sql) and _CTE_WRITE_RE.search(sql))
+
+
+def _is_cacheable(sql: str) -> bool:
+    """True for plain reads (SELECT, WITH ... SELECT) whose result run_query_cached may keep."""
+    return bool(_READ_RE.match(sql)) and not _is_write(sql)
+
+
+def _cache_epoch() -> int:
+    """Current TTL window; part of the result cache key, so old entries stop matching."""
+    return int(time.monotonic() // QUERY_CACHE_TTL_SECONDS)
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def run_query_cached(
+    query: str,
+    params: Tuple[Tuple[str, Any], ...] = (),
+    epoch: int = 0,
+) -> Tuple[Tuple[str, ...], Tuple[Tuple[Any, ...], ...]]:
+    """
+    Run a read-only SELECT and cache its result as (column names, row tuples).
+
+    `params` is a tuple of (name, value) pairs so the call is hashable, and
+    `epoch` is the TTL window (see _cache_epoch). The result is immutable;
+    run_query builds fresh dicts from it for every caller.
+    """
+    with _get_read_engine().connect() as conn:
+        result = conn.execute(_statement(query), dict(params))
+        return tuple(result.keys()), tuple(tuple(row) for row in result)
+
+
+def _params_key(params: Optional[dict]) -> Optional[Tuple[Tuple[str, Any], ...]]:
+    """Hashable form of the bind params, or None if a value isn't hashable."""
+    key = tuple(sorted((params or {}).items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def run_query(
+    query: Union[str, TextClause],
+    params: dict = None,
+    readonly: bool = True,
+) -> List[Dict[str, Any]]:
     """
     Run raw SQL on the telecom DB and return rows as dictionaries.
     This is critical for CrewAI, LangChain, and the plan agent.
+
+    `query` is a SQL string or a prebuilt text() statement; pass the same
+    statement object for repeated queries and bind values through `params`.
+
+    Read-only SELECT / WITH queries are served from run_query_cached; writes
+    (INSERT/UPDATE/DELETE/REPLACE/DDL) clear that cache, other reads such as
+    PRAGMA or EXPLAIN run uncached and leave it alone.
+
+    Connections come from a shared pool, so this is safe to call from threads.
+    Reads go to the read engine (DB_READ_URI). Writes (see _is_write) always
+    go to the primary DB and are committed; pass readonly=False for anything
+    else that must run there.
+    """
+    sql = query.text if isinstance(query, TextClause) else query
+    # The read engine is query_only, so writes can't go there whatever the caller says
+    readonly = readonly and not _is_write(sql)
+    if readonly and _is_cacheable(sql):
+        params_key = _params_key(params)
+        if params_key is not None:
+            columns, rows = run_query_cached(sql, params_key, _cache_epoch())
+            return [dict(zip(columns, row)) for row in rows]
+
+    stmt = query if isinstance(query, TextClause) else _statement(query)
+    engine = _get_read_engine() if readonly else _get_query_engine()
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(stmt, params or {})
+            rows = [dict(row) for row in result.mappings()] if result.returns_rows else []
+            if not readonly:
+                conn.commit()
+            return rows
+    finally:
+        if _is_write(sql):
+            run_query_cached.cache_clear()
+
+
+def run_query_rows(
+    query: Union[str, TextClause],
+    params: dict = None,
+) -> Tuple[Tuple[str, ...], Sequence[Tuple[Any, ...]]]:
+    """
+    Read-only variant of run_query that doesn't build a dict per row.
+
+    Returns (column names, rows) with each row a plain tuple in column order,
+    e.g. `for (name,) in rows`. Use it where the caller only needs values by
+    position; run_query (dicts) stays the API for the agents' prompts.
     """
-    import sqlite3
+    sql = query.text if isinstance(query, TextClause) else query
+    params_key = _params_key(params)
+    if _is_cacheable(sql) and params_key is not None:
+        return run_query_cached(sql, params_key, _cache_epoch())
 
-    conn = sqlite3.connect(get_db_path())
-    conn.row_factory = sqlite3.Row  # rows become dict-like
-    cur = conn.cursor()
+    stmt = query if isinstance(query, TextClause) else _statement(query)
+    try:
+        with _get_read_engine().connect() as conn:
+            result = conn.execute(stmt, params or {})
+            if not result.returns_rows:
+                return (), ()
+            return tuple(result.keys()), result.all()
+    finally:
+        if _is_write(sql):
+            run_query_cached.cache_clear()
 
-    cur.execute(query, params or {})
-    rows = cur.fetchall()
 
-    results = [dict(row) for row in rows]
+def run_query_iter(
+    query: Union[str, TextClause],
+    params: dict = None,
+    batch_size: int = ITER_BATCH_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Read-only, streaming variant of run_query for large result sets.
+
+    Yields row dicts, fetching `batch_size` rows at a time instead of
+    materializing the whole result first. Not cached. The pooled connection
+    is held until the generator is exhausted or closed.
+    """
+    stmt = query if isinstance(query, TextClause) else _statement(query)
+    with _get_read_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(stmt, params or {})
+        rows = result.mappings()
+        while batch := rows.fetchmany(batch_size):
+            for row in batch:
+                yield dict(row)
+
 
-    conn.close()
-    return results
+@functools.lru_cache(maxsize=1)
+def _table_names() -> Tuple[str, ...]:
+    _, rows = run_query_rows("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+    return tuple(name for (name,) in rows)
 
 
 def get_tables() -> List[str]:
-    """List all table names in the telecom DB."""
-    rows = run_query("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-    return [r["name"] for r in rows]
+    """List all table names in the telecom DB (cached; see refresh_tables)."""
+    return list(_table_names())
+
+
+@functools.lru_cache(maxsize=None)
+def has_table(name: str) -> bool:
+    """Return True if the table exists in the telecom DB (cached, the schema is static)."""
+    return name in _table_names()
+
+
+def refresh_tables() -> None:
+    """Forget the cached table list, e.g. after a schema change."""
+    _table_names.cache_clear()
+    has_table.cache_clear()
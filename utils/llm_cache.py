@@ -0,0 +1,254 @@
+# utils/llm_cache.py
+from __future__ import annotations
+
+import asyncio
+import functools
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, FrozenSet, Hashable, List, Optional, Tuple
+
+# ---- Optional FAISS integration (semantic tier) ----
+try:
+    import faiss  # type: ignore
+    import numpy as np
+
+    HAS_FAISS = True
+except Exception:
+    # Without FAISS the cache still works, but only for exact matches
+    faiss = None  # type: ignore
+    np = None  # type: ignore
+    HAS_FAISS = False
+
+
+# Queries about the customer's live state must always hit the backend
+_DYNAMIC_QUERY_RE = re.compile(
+    r"\b(my (bill|usage|balance|account|charges?)|this month|last month|today|right now)\b",
+    re.IGNORECASE,
+)
+
+# Words that flip a question's meaning while barely moving its embedding
+# ("enable VoLTE" / "disable VoLTE", "my May bill" / "my June bill"); a
+# semantic hit needs the same ones (and the same numbers) as the cached query.
+# "on" is left out ("on my phone"); "off" alone tells on/off apart.
+_CONTRAST_TERMS = frozenset(
+    """
+    enable disable enabled disabled activate deactivate off add remove
+    start stop cancel resume block unblock lock unlock upgrade downgrade
+    increase decrease more less higher lower cheaper costlier not no without
+    before after incoming outgoing prepaid postpaid domestic international
+    january february march april may june july august september october
+    november december jan feb mar apr jun jul aug sep sept oct nov dec
+    """.split()
+)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# How long a cached answer is served before it is recomputed
+DEFAULT_TTL_SECONDS = 3600
+
+# Minimum cosine similarity for a semantic hit. OpenAI embeddings put even
+# loosely related telecom questions above 0.9, so only near-paraphrases pass.
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+_MISS = object()
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivial variations share a key."""
+    return " ".join(query.lower().split())
+
+
+def is_dynamic_query(query: str) -> bool:
+    """True if the query references state that changes over time (bills, usage...)."""
+    return bool(_DYNAMIC_QUERY_RE.search(query))
+
+
+def contrast_terms(query: str) -> FrozenSet[str]:
+    """Meaning-flipping words and numbers in a normalized query (see _CONTRAST_TERMS)."""
+    return frozenset(
+        word
+        for word in _WORD_RE.findall(query)
+        if word in _CONTRAST_TERMS or any(ch.isdigit() for ch in word)
+    )
+
+
+def _default_embed(text: str) -> List[float]:
+    """Embed text with the embedding model configured for LlamaIndex."""
+    from llama_index.core import Settings
+
+    return Settings.embed_model.get_text_embedding(text)
+
+
+class SemanticCache:
+    """
+    Two-tier response cache.
+
+      1. Exact match on (namespace, normalized query), kept in an LRU dict.
+      2. Embedding similarity within the same namespace (FAISS inner product
+         over L2-normalized vectors), for paraphrases of earlier queries.
+         A hit also needs the same contrast terms (see contrast_terms), as
+         embeddings put "enable VoLTE" and "disable VoLTE" side by side.
+
+    Entries expire after `ttl_seconds` (None keeps them until evicted).
+
+    The namespace is any hashable (e.g. ("plan", customer_email)), so answers
+    are never shared across agents or customers. Only the `max_namespaces`
+    most recently used namespaces keep a FAISS index.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        maxsize: int = 1024,
+        max_namespaces: int = 256,
+        ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS,
+        embed_fn: Optional[Callable[[str], List[float]]] = _default_embed,
+    ) -> None:
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.max_namespaces = max_namespaces
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn if HAS_FAISS else None
+        # Values are stored as (value, expiry time) and, in the semantic tier,
+        # with the query they answered: (query, value, expiry time)
+        self._exact: "OrderedDict[Tuple[Hashable, str], Tuple[Any, float]]" = OrderedDict()
+        self._semantic: "OrderedDict[Hashable, Tuple[Any, List[Tuple[str, Any, float]]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def _embed(self, query: str):
+        """Return a normalized (1, d) float32 vector, or None if embedding fails."""
+        if self.embed_fn is None:
+            return None
+        try:
+            vec = np.asarray([self.embed_fn(query)], dtype="float32")
+        except Exception:
+            return None
+        faiss.normalize_L2(vec)
+        return vec
+
+    def _expiry(self) -> float:
+        return float("inf") if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+
+    def _has_exact(self, namespace: Hashable, key: str) -> bool:
+        """True if the exact tier holds an unexpired answer (no embedding needed)."""
+        with self._lock:
+            entry = self._exact.get((namespace, key))
+        return entry is not None and entry[1] > time.monotonic()
+
+    def _lookup(self, namespace: Hashable, key: str, vec) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            if (namespace, key) in self._exact:
+                value, expires_at = self._exact[(namespace, key)]
+                if expires_at > now:
+                    self._exact.move_to_end((namespace, key))
+                    return value
+                del self._exact[(namespace, key)]
+            if vec is not None and namespace in self._semantic:
+                self._semantic.move_to_end(namespace)
+                index, entries = self._semantic[namespace]
+                scores, ids = index.search(vec, 1)
+                if ids[0][0] >= 0 and scores[0][0] >= self.threshold:
+                    cached_key, value, expires_at = entries[ids[0][0]]
+                    if expires_at > now and contrast_terms(cached_key) == contrast_terms(key):
+                        return value
+        return _MISS
+
+    def _store(self, namespace: Hashable, key: str, vec, value: Any) -> None:
+        expires_at = self._expiry()
+        with self._lock:
+            self._exact[(namespace, key)] = (value, expires_at)
+            self._exact.move_to_end((namespace, key))
+            while len(self._exact) > self.maxsize:
+                self._exact.popitem(last=False)
+
+            if vec is None:
+                return
+            index, entries = self._semantic.get(namespace, (None, []))
+            if index is None or index.ntotal >= self.maxsize:
+                # Start the namespace over rather than tracking per-vector age
+                index, entries = faiss.IndexFlatIP(vec.shape[1]), []
+            index.add(vec)
+            entries.append((key, value, expires_at))
+            self._semantic[namespace] = (index, entries)
+            self._semantic.move_to_end(namespace)
+            while len(self._semantic) > self.max_namespaces:
+                self._semantic.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        namespace: Hashable,
+        query: str,
+        compute: Callable[[], Any],
+        cache_if: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Return a cached answer for the query, or compute and store it."""
+        key = normalize_query(query)
+        exact_hit = self._has_exact(namespace, key)
+        vec = None if exact_hit else self._embed(key)
+
+        value = self._lookup(namespace, key, vec)
+        if value is not _MISS:
+            return value
+
+        value = compute()
+        if cache_if is None or cache_if(value):
+            self._store(namespace, key, vec, value)
+        return value
+
+    async def aget_or_compute(
+        self,
+        namespace: Hashable,
+        query: str,
+        compute: Callable[[], Awaitable[Any]],
+        cache_if: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Async get_or_compute; the (blocking) query embedding runs off the event loop."""
+        key = normalize_query(query)
+        exact_hit = self._has_exact(namespace, key)
+        vec = None if exact_hit else await asyncio.to_thread(self._embed, key)
+
+        value = self._lookup(namespace, key, vec)
+        if value is not _MISS:
+            return value
+
+        value = await compute()
+        if cache_if is None or cache_if(value):
+            self._store(namespace, key, vec, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+
+
+def semantic_cache(
+    cache: SemanticCache,
+    key: Callable[..., Optional[Tuple[Hashable, str]]],
+    cache_if: Optional[Callable[[Any], bool]] = None,
+):
+    """
+    Decorate a function so its results go through a SemanticCache.
+
+    key(*args, **kwargs) returns (namespace, query) for the call, or None to
+    bypass the cache (e.g. for queries about the customer's live bill).
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            if cache_key is None:
+                return func(*args, **kwargs)
+            namespace, query = cache_key
+            return cache.get_or_compute(
+                namespace, query, lambda: func(*args, **kwargs), cache_if
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,36 @@
+# utils/streaming.py
+from __future__ import annotations
+
+from typing import Iterable, Iterator
+
+# Token re-batching for streamed LLM output: the first tokens go out one by one
+# (fast time-to-first-token), later ones in growing groups to cut per-write overhead.
+DEFAULT_MIN_BATCH_SIZE = 1
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_GROWTH_FACTOR = 3
+
+
+def batch_stream(
+    chunks: Iterable[str],
+    min_batch_size: int = DEFAULT_MIN_BATCH_SIZE,
+    max_batch_size: int = DEFAULT_BATCH_SIZE,
+    growth_factor: int = DEFAULT_GROWTH_FACTOR,
+) -> Iterator[str]:
+    """
+    Regroup a stream of text chunks into batches of 1, 3, 9, 16, 16, ... chunks.
+
+    Empty chunks (e.g. role-only deltas) are skipped; whatever is left at the
+    end of the stream is flushed as a final batch.
+    """
+    batch_size = min_batch_size
+    buffer = []
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer.append(chunk)
+        if len(buffer) >= batch_size:
+            yield "".join(buffer)
+            buffer.clear()
+            batch_size = min(batch_size * growth_factor, max_batch_size)
+    if buffer:
+        yield "".join(buffer)